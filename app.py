@@ -1,133 +1,3054 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, current_app, g, has_app_context, has_request_context, request, jsonify, Request, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
 from flask_migrate import Migrate
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
 import base64
-from PIL import Image
+from PIL import Image, ImageOps
 import io
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import deferred, undefer
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import operators
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from functools import wraps
+from contextlib import contextmanager
 
 import zipfile
 import io
 import os
-from flask import send_file
-from datetime import datetime
+import atexit
+import bisect
+import copy
+import fcntl
+import random
+import re
+import itertools
 import tempfile
-import shutil
+import tarfile
+import hashlib
+import uuid
+import click
+import json
+import struct
+import queue
+import threading
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import send_file
+from datetime import datetime, timedelta, timezone
+
+
+
+try:
+    import zstandard
+except ImportError:  # Optional: only needed for ?compression=zstd
+    zstandard = None
+
+
+
+# Configuration
+class Config:
+    # Database configuration
+    MYSQL_HOST = os.getenv('MYSQL_HOST', 'localhost')
+    MYSQL_USER = os.getenv('MYSQL_USER', 'root')
+    MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', 'root')
+    MYSQL_DATABASE = os.getenv('MYSQL_DATABASE', 'singora_db')
+    
+    SQLALCHEMY_DATABASE_URI = f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}/{MYSQL_DATABASE}'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    
+    # Optional read replica for read-only routes (same credentials and database name)
+    MYSQL_REPLICA_HOST = os.getenv('MYSQL_REPLICA_HOST')
+    SQLALCHEMY_BINDS = (
+        {'replica': f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_REPLICA_HOST}/{MYSQL_DATABASE}'}
+        if MYSQL_REPLICA_HOST else {}
+    )
+    
+    # Connection pool, per engine and per gunicorn worker process
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),  # seconds to wait for a free connection
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),  # keep below MySQL wait_timeout
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    }
+    
+    # File upload configuration
+    UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
+    MAX_IMAGE_SIZE = 16 * 1024 * 1024  # 16MB max file size
+    # Whole-request limit for single-image routes; only the batch endpoint gets the larger
+    # MAX_BATCH_CONTENT_LENGTH, so single uploads are never buffered beyond one image
+    MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
+    MAX_BATCH_CONTENT_LENGTH = int(os.getenv('MAX_BATCH_CONTENT_LENGTH', 256 * 1024 * 1024))
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+    
+    # Image validation: 'fast' sniffs PNG/JPEG headers on upload and leaves the
+    # full decode to `flask verify-images`; 'full' runs PIL verify() inline
+    IMAGE_VALIDATION_MODE = os.getenv('IMAGE_VALIDATION_MODE', 'fast')
+    
+    # Response cache for stats/info endpoints: 'memory' (per process) or
+    # 'redis' (shared across gunicorn workers, requires the redis package)
+    RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'memory')
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 60))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 256))
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    
+    # Thumbnails: generated once per (content, size, format), cached on disk
+    # and in a bounded in-memory LRU
+    THUMBNAIL_SIZES = {int(size) for size in os.getenv('THUMBNAIL_SIZES', '64,128,256,512').split(',')}
+    THUMBNAIL_CACHE_FOLDER = os.getenv('THUMBNAIL_CACHE_FOLDER', 'thumbnails')
+    THUMBNAIL_MEMORY_CACHE_BYTES = int(os.getenv('THUMBNAIL_MEMORY_CACHE_BYTES', 64 * 1024 * 1024))
+    THUMBNAIL_DISK_CACHE_BYTES = int(os.getenv('THUMBNAIL_DISK_CACHE_BYTES', 1024 * 1024 * 1024))
+    
+    # Background jobs (post-upload work such as full image verification)
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+    JOB_QUEUE_PERSISTENT = os.getenv('JOB_QUEUE_PERSISTENT', 'False').lower() == 'true'
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+    JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', 600))  # seconds before a running job, or an export without progress, is retried
+    
+    # Raw uploads (POST /api/v1/images/ingest) spill to disk above this many bytes
+    INGEST_SPOOL_BYTES = int(os.getenv('INGEST_SPOOL_BYTES', 1024 * 1024))
+    
+    # Batch uploads
+    MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 500))
+    BATCH_VALIDATION_WORKERS = int(os.getenv('BATCH_VALIDATION_WORKERS', os.cpu_count() or 4))
+    
+    # Default archive compression for downloads: stored, deflate or zstd (tar.zst)
+    ARCHIVE_DEFAULT_COMPRESSION = os.getenv('ARCHIVE_DEFAULT_COMPRESSION', 'stored')
+    ARCHIVE_ZSTD_LEVEL = int(os.getenv('ARCHIVE_ZSTD_LEVEL', 3))
+    
+    # Parallel archive builds for download/all
+    ARCHIVE_WORKERS = int(os.getenv('ARCHIVE_WORKERS', os.cpu_count() or 4))
+    ARCHIVE_SPOOL_BYTES = int(os.getenv('ARCHIVE_SPOOL_BYTES', 32 * 1024 * 1024))  # spill to disk above this
+    
+    # Background exports (POST /api/v1/exports)
+    EXPORT_FOLDER = os.getenv('EXPORT_FOLDER', 'exports')
+    EXPORT_RETENTION = int(os.getenv('EXPORT_RETENTION', 24 * 3600))  # seconds finished artifacts are kept
+    EXPORT_PROGRESS_INTERVAL = int(os.getenv('EXPORT_PROGRESS_INTERVAL', 100))  # entries between progress updates
+    
+    # singora_images is partitioned by month on MySQL; `flask maintain-partitions` keeps
+    # this many months pre-created ahead of the current one
+    PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', 3))
+    # Retention (`flask prune-images`): drop whole months older than RETENTION_MONTHS (0 keeps
+    # everything) and bulk-delete per label by age, e.g. RETENTION_LABEL_DAYS=scratch:30,tmp:7
+    RETENTION_MONTHS = int(os.getenv('RETENTION_MONTHS', 0))
+    RETENTION_LABEL_DAYS = {
+        label.strip(): int(days)
+        for label, days in (item.rsplit(':', 1) for item in os.getenv('RETENTION_LABEL_DAYS', '').split(',') if item.strip())
+    }
+    RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 5000))  # rows per bulk-delete transaction
+    
+    # Blob storage: 'local' (sharded under UPLOAD_FOLDER) or 's3'
+    BLOB_STORAGE_BACKEND = os.getenv('BLOB_STORAGE_BACKEND', 'local')
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')  # e.g. a local MinIO at http://localhost:9000
+    S3_BUCKET = os.getenv('S3_BUCKET', 'singora-images')
+    S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY')
+    S3_SECRET_KEY = os.getenv('S3_SECRET_KEY')
+    S3_REGION = os.getenv('S3_REGION', 'us-east-1')
+    
+    # Bulk reads (downloads/exports) fetch rows in batches of this size
+    BULK_FETCH_BATCH_SIZE = int(os.getenv('BULK_FETCH_BATCH_SIZE', 100))
+    
+    # Prometheus metrics at /metrics. Each gunicorn worker counts on its own; with
+    # METRICS_DIR set, workers snapshot there and /metrics reports the sum
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+    METRICS_DIR = os.getenv('METRICS_DIR', '')
+    METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', 5))  # seconds between snapshots
+    
+    # Logging: a background thread writes queued records as 'json' lines or 'text'.
+    # LOG_FILE may contain {pid}; under gunicorn '-{pid}' is added when it doesn't ('' logs to stderr only)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+    LOG_FILE = os.getenv('LOG_FILE', 'app.log')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 50 * 1024 * 1024))  # size-based rotation
+    LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')  # e.g. 'midnight' to rotate by time instead
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 7))
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # records beyond this are dropped, never waited on
+    LOG_ACCESS_SAMPLE_RATE = float(os.getenv('LOG_ACCESS_SAMPLE_RATE', 1.0))  # share of non-error access lines kept
+    
+    # Security
+    SECRET_KEY = os.getenv('SECRET_KEY', '12345')
+    API_KEY = os.getenv('API_KEY', '12345')
+
+# Metrics (Prometheus text exposition format)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def format_metric_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def format_metric_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+class Metric:
+    """A metric family: one value per combination of label values"""
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        """Copy of the values as {label values tuple: value}"""
+        with self._lock:
+            return {key: copy.deepcopy(value) for key, value in self._values.items()}
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def samples(self, values):
+        for key, value in values.items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts (last one is +Inf), sum, count]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def merge(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def samples(self, values):
+        for key, (counts, total, count) in values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, 'le': format_metric_value(float(bound))}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+class MetricsRegistry:
+    """Process-local metrics, optionally summed across gunicorn workers.
+
+    Collectors registered with @collector refresh gauges (pool and job queue
+    state) right before a snapshot. With METRICS_DIR set every worker writes
+    its snapshot to METRICS_DIR/<pid>.json every METRICS_FLUSH_INTERVAL
+    seconds and /metrics adds them up. Exited workers are folded into
+    exited.json so counters never go backwards; their gauges are dropped.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, f):
+        """Register f() to refresh gauges before each snapshot"""
+        self.collectors.append(f)
+        return f
+
+    def collect(self):
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                logger.warning("Metrics collector %s failed: %s", collect.__name__, e)
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def _load(self, path):
+        """Read a snapshot file as {name: {label values tuple: value}}, or None if unreadable"""
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return {name: {tuple(key): value for key, value in values} for name, values in entries.items()}
+
+    def _write(self, path, snapshot):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({name: [[list(key), value] for key, value in values.items()]
+                       for name, values in snapshot.items()}, f)
+        os.replace(tmp_path, path)
+
+    def _merge(self, totals, snapshot, gauges=True):
+        """Add snapshot into totals (in place); gauges are skipped unless gauges is true"""
+        metrics = {metric.name: metric for metric in self.metrics}
+        for name, values in snapshot.items():
+            metric = metrics.get(name)
+            if metric is None or (metric.type == 'gauge' and not gauges):
+                continue
+            merged = totals.setdefault(name, {})
+            for key, value in values.items():
+                merged[key] = metric.merge(merged[key], value) if key in merged else value
+        return totals
+
+    def flush(self):
+        """Write this process's snapshot to METRICS_DIR/<pid>.json"""
+        snapshot = self.collect()
+        self._write(os.path.join(current_app.config['METRICS_DIR'], f"{os.getpid()}.json"), snapshot)
+        return snapshot
+
+    def start(self):
+        """Start the current app's snapshot thread (once per process) when METRICS_DIR is set"""
+        app = current_app._get_current_object()
+        state = app.extensions['singora_metrics']
+        if state['flushing'] or not app.config['METRICS_DIR']:
+            return
+        with self._lock:
+            if state['flushing']:
+                return
+            state['flushing'] = True
+            os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+            threading.Thread(target=self._flush_loop, args=(app,), name='metrics-flush', daemon=True).start()
+            atexit.register(self._flush_in_app, app)
+
+    def _flush_in_app(self, app):
+        try:
+            with app.app_context():
+                self.flush()
+        except Exception as e:
+            logger.warning("Metrics snapshot failed: %s", e)
+
+    def _flush_loop(self, app):
+        while True:
+            time.sleep(app.config['METRICS_FLUSH_INTERVAL'])
+            self._flush_in_app(app)
+
+    def _fold_exited(self, directory):
+        """Merge the snapshots of exited workers into exited.json, so recycled workers don't pile up files"""
+        exited = [
+            file_name for file_name in os.listdir(directory)
+            if file_name.endswith('.json') and file_name[:-5].isdigit() and not process_alive(int(file_name[:-5]))
+        ]
+        if not exited:
+            return
+        path = os.path.join(directory, 'exited.json')
+        totals = self._load(path) or {}
+        for file_name in exited:
+            snapshot = self._load(os.path.join(directory, file_name))
+            if snapshot:
+                self._merge(totals, snapshot, gauges=False)
+        self._write(path, totals)
+        for file_name in exited:
+            os.remove(os.path.join(directory, file_name))
+
+    def _aggregate(self, own):
+        """Sum this process's snapshot with the other workers' and exited.json"""
+        directory = current_app.config['METRICS_DIR']
+        totals = self._merge({}, own)
+        # Folding and reading under one lock, so no scrape sees a worker counted twice
+        with open(os.path.join(directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._fold_exited(directory)
+            for file_name in os.listdir(directory):
+                name, extension = os.path.splitext(file_name)
+                if extension != '.json' or name == str(os.getpid()):
+                    continue
+                snapshot = self._load(os.path.join(directory, file_name))
+                if snapshot:
+                    self._merge(totals, snapshot, gauges=name.isdigit())
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text format"""
+        if current_app.config['METRICS_DIR']:
+            self.start()
+            snapshot = self._aggregate(self.flush())
+        else:
+            snapshot = self.collect()
+        
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples(snapshot[metric.name]):
+                lines.append(f"{name}{format_metric_labels(labels)} {format_metric_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+def process_alive(pid):
+    """Whether a process with this pid exists (e.g. a sibling gunicorn worker)"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def metrics_endpoint():
+    """Endpoint label for the current work: the view, 'job:<type>' in job workers, else 'background'"""
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    if has_app_context():
+        return g.get('metrics_endpoint', 'background')
+    return 'background'
+
+metrics = MetricsRegistry()
+http_request_duration = metrics.histogram(
+    'singora_http_request_duration_seconds',
+    'Request duration until the response body is fully sent',
+    ('endpoint', 'method', 'status')
+)
+http_request_bytes = metrics.counter(
+    'singora_http_request_bytes_total', 'Request body bytes received (uploads)', ('endpoint',)
+)
+http_response_bytes = metrics.counter(
+    'singora_http_response_bytes_total', 'Response body bytes sent (downloads)', ('endpoint',)
+)
+db_query_duration = metrics.histogram(
+    'singora_db_query_duration_seconds', 'SQL statement execution time', ('endpoint', 'operation'), FAST_BUCKETS
+)
+db_pool_wait = metrics.histogram(
+    'singora_db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection', ('bind',), FAST_BUCKETS
+)
+db_pool_timeouts = metrics.counter(
+    'singora_db_pool_checkout_timeouts_total', 'Connection checkouts that failed or timed out', ('bind',)
+)
+db_pool_connections = metrics.gauge(
+    'singora_db_pool_connections', 'Pooled connections by state (in_use, idle, overflow)', ('bind', 'state')
+)
+archive_build_duration = metrics.histogram(
+    'singora_archive_build_duration_seconds',
+    'Time spent building an archive, excluding time blocked on the client',
+    ('endpoint', 'compression')
+)
+image_validation_duration = metrics.histogram(
+    'singora_image_validation_duration_seconds',
+    'Upload validation time (check: header sniff or full PIL verify)',
+    ('endpoint', 'check'), FAST_BUCKETS
+)
+job_duration = metrics.histogram(
+    'singora_job_duration_seconds', 'Background job run time by outcome', ('job_type', 'status')
+)
+job_queue_depth = metrics.gauge('singora_job_queue_depth', 'Jobs waiting for a worker')
+jobs_running = metrics.gauge('singora_jobs_running', 'Jobs currently running')
+
+# SQL timings, labelled with the endpoint (or job) that issued the statement
+SQL_OPERATIONS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE'}
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    operation = statement.lstrip()[:6].upper()
+    db_query_duration.observe(
+        time.perf_counter() - started,
+        endpoint=metrics_endpoint(),
+        operation=operation if operation in SQL_OPERATIONS else 'OTHER'
+    )
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query_timer(context):
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
+
+def observe_stream(chunks, histogram, **labels):
+    """Yield from chunks, observing the time spent producing them once exhausted.
+
+    Time the consumer holds a chunk (e.g. a slow client) is not counted, and
+    an abandoned stream is not observed at all.
+    """
+    chunks = iter(chunks)
+    busy = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                busy += time.perf_counter() - started
+                break
+            busy += time.perf_counter() - started
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    histogram.observe(busy, **labels)
+
+# Database connection pooling and read routing
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+
+    bind_key = 'primary'  # set per engine in create_app(), for metric labels
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_times = deque(maxlen=1000)
+        self.checkouts = 0
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self.timeouts += 1
+            db_pool_timeouts.inc(bind=self.bind_key)
+            raise
+        waited = time.perf_counter() - started
+        self.wait_times.append(waited)
+        self.checkouts += 1
+        db_pool_wait.observe(waited, bind=self.bind_key)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.bind_key = self.bind_key
+        return pool
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """Session that sends queries from @use_replica views to the 'replica' bind.
+
+    Flushes, and everything outside such views, go to the primary. Without a
+    replica configured every query goes to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and g and g.get('use_replica'):
+            replica = self._db.engines.get('replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+# Extensions are bound to the app in create_app()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+migrate = Migrate()
+
+# Routes, error handlers and CLI commands (`flask migrate-blobs`, ...) register on this blueprint
+api = Blueprint('api', __name__, cli_group=None)
+
+# Endpoints whose request bodies may reach MAX_BATCH_CONTENT_LENGTH
+BATCH_ENDPOINTS = {'api.upload_images_batch'}
+
+class UploadLimitRequest(Request):
+    """Request whose body limit depends on the matched endpoint (see BATCH_ENDPOINTS)"""
+
+    @property
+    def max_content_length(self):
+        if not current_app:
+            return None
+        if self.endpoint in BATCH_ENDPOINTS:
+            return current_app.config['MAX_BATCH_CONTENT_LENGTH']
+        return current_app.config['MAX_CONTENT_LENGTH']
+
+# Logging: callers only enqueue records; one listener thread formats and writes them
+logger = logging.getLogger(__name__)
+log_records_dropped = metrics.counter(
+    'singora_log_records_dropped_total', 'Log records dropped because the log queue was full'
+)
+# Attributes every LogRecord has; anything else (request_id, extra=...) is a JSON field
+LOG_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,128}$')
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full instead of waiting"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+    def prepare(self, record):
+        # Merge args and render tracebacks in the caller, where they are still valid;
+        # JSON/text formatting is left to the listener thread
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the request ID and endpoint of the thread that logged them"""
+
+    def filter(self, record):
+        record.request_id = g.get('request_id') if has_app_context() else None
+        record.endpoint = metrics_endpoint()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request_id, endpoint, extras, exception"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in LOG_RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+def access_status(record):
+    """HTTP status of a werkzeug or gunicorn access log record, or None if it has none"""
+    try:
+        if isinstance(record.args, dict):  # gunicorn access log atoms
+            return int(record.args['s'])
+        if isinstance(record.args, tuple) and len(record.args) == 3:  # werkzeug: request line, status, size
+            return int(record.args[1])
+    except (KeyError, TypeError, ValueError):
+        pass
+    return None
+
+class AccessLogSampler(logging.Filter):
+    """Keep every error access line (status >= 400) but only a `rate` share of the others"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1:
+            return True
+        status = access_status(record)
+        return status is None or status >= 400 or random.random() < self.rate
+
+_log_listener = None
+
+def log_file_path(log_file):
+    """This process's log file: gunicorn workers each get their own, so they never rotate each other's"""
+    if '{pid}' not in log_file and os.getenv('SERVER_SOFTWARE', '').startswith('gunicorn/'):
+        root, extension = os.path.splitext(log_file)
+        log_file = f"{root}-{{pid}}{extension}"
+    return log_file.format(pid=os.getpid())
+
+def configure_logging(config):
+    """Send all logging through a bounded queue drained by a QueueListener thread.
+
+    Request threads only enqueue; the listener writes to stderr and the
+    rotating LOG_FILE, so slow log I/O never stalls a request.
+    """
+    stop_log_listener()
+    
+    if config['LOG_FORMAT'] == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s')
+    
+    handlers = [logging.StreamHandler()]
+    if config['LOG_FILE']:
+        path = log_file_path(config['LOG_FILE'])
+        if config['LOG_ROTATE_WHEN']:
+            handlers.append(TimedRotatingFileHandler(
+                path, when=config['LOG_ROTATE_WHEN'], backupCount=config['LOG_BACKUP_COUNT']
+            ))
+        else:
+            handlers.append(RotatingFileHandler(
+                path, maxBytes=config['LOG_MAX_BYTES'], backupCount=config['LOG_BACKUP_COUNT']
+            ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=config['LOG_QUEUE_SIZE']))
+    queue_handler.addFilter(RequestContextFilter())
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, NonBlockingQueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config['LOG_LEVEL'])
+    
+    for name in ('werkzeug', 'gunicorn.access'):
+        access_logger = logging.getLogger(name)
+        for log_filter in access_logger.filters[:]:
+            if isinstance(log_filter, AccessLogSampler):
+                access_logger.removeFilter(log_filter)
+        access_logger.addFilter(AccessLogSampler(config['LOG_ACCESS_SAMPLE_RATE']))
+    
+    global _log_listener
+    _log_listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+
+@atexit.register
+def stop_log_listener():
+    """Write out records still queued (at shutdown, or before reconfiguring)"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+# Blob storage
+class BlobStore:
+    """Content-addressed storage for image bytes, keyed by SHA-256 hex digest"""
+
+    def put(self, data, digest=None):
+        """Store data (if not already present) and return its digest"""
+        raise NotImplementedError
+
+    def put_stream(self, stream, digest=None, chunk_size=64 * 1024):
+        """Store a readable file chunk by chunk (if not already present) and return its digest"""
+        raise NotImplementedError
+
+    def get(self, digest):
+        """Return the bytes stored under digest"""
+        raise NotImplementedError
+
+    def exists(self, digest):
+        raise NotImplementedError
+
+    def delete(self, digest):
+        raise NotImplementedError
+
+    def local_path(self, digest):
+        """Filesystem path of the blob, or None if the backend is not local"""
+        return None
+
+class LocalBlobStore(BlobStore):
+    """Blobs stored as files sharded by digest prefix: ab/cd/abcd..."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, data, digest=None):
+        digest = digest or hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file first so readers never see a partial blob
+            tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def put_stream(self, stream, digest=None, chunk_size=64 * 1024):
+        if digest and os.path.exists(self._path(digest)):
+            return digest
+        
+        hasher = hashlib.sha256()
+        tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: stream.read(chunk_size), b''):
+                    hasher.update(chunk)
+                    f.write(chunk)
+            digest = digest or hasher.hexdigest()
+            path = self._path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return digest
+
+    def get(self, digest):
+        with open(self._path(digest), 'rb') as f:
+            return f.read()
+
+    def exists(self, digest):
+        return os.path.exists(self._path(digest))
+
+    def delete(self, digest):
+        try:
+            os.unlink(self._path(digest))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, digest):
+        return self._path(digest)
+
+class S3BlobStore(BlobStore):
+    """Blobs stored in an S3-compatible bucket (AWS, MinIO, localstack...)"""
+
+    def __init__(self, bucket, endpoint_url=None, access_key=None, secret_key=None, region=None):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError('boto3 is required for the s3 blob storage backend')
+        self.bucket = bucket
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region
+        )
+
+    def _key(self, digest):
+        return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+    def put(self, data, digest=None):
+        digest = digest or hashlib.sha256(data).hexdigest()
+        if not self.exists(digest):
+            self.client.put_object(Bucket=self.bucket, Key=self._key(digest), Body=data)
+        return digest
+
+    def put_stream(self, stream, digest=None, chunk_size=64 * 1024):
+        if digest is None:
+            # The key is the digest, so hash into a spooled copy before uploading
+            hasher = hashlib.sha256()
+            spooled = tempfile.SpooledTemporaryFile(max_size=chunk_size * 16)
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                hasher.update(chunk)
+                spooled.write(chunk)
+            spooled.seek(0)
+            stream, digest = spooled, hasher.hexdigest()
+        if not self.exists(digest):
+            # upload_fileobj sends multipart chunks instead of reading the whole body
+            self.client.upload_fileobj(stream, self.bucket, self._key(digest))
+        return digest
+
+    def get(self, digest):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(digest))['Body'].read()
+
+    def exists(self, digest):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(digest))
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def delete(self, digest):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(digest))
+
+def create_blob_store(config):
+    """Build the blob store selected by BLOB_STORAGE_BACKEND"""
+    backend = config['BLOB_STORAGE_BACKEND']
+    if backend == 'local':
+        return LocalBlobStore(config['UPLOAD_FOLDER'])
+    if backend == 's3':
+        return S3BlobStore(
+            config['S3_BUCKET'],
+            endpoint_url=config['S3_ENDPOINT_URL'],
+            access_key=config['S3_ACCESS_KEY'],
+            secret_key=config['S3_SECRET_KEY'],
+            region=config['S3_REGION']
+        )
+    raise RuntimeError(f"Unknown blob storage backend: {backend}")
+
+def get_blob_store():
+    """Return the current app's blob store"""
+    return current_app.extensions['singora_blob_store']
+
+# Database Models
+class ImageData(db.Model):
+    __tablename__ = 'singora_images'
+    __table_args__ = (
+        # label_name + date (+ timestamp order) and date (+ label) are the hot filters;
+        # the first also serves label_name-only lookups as its leftmost prefix
+        db.Index('ix_singora_images_label_date_ts', 'label_name', 'date', 'timestamp'),
+        db.Index('ix_singora_images_date_label', 'date', 'label_name'),
+        db.Index('ix_singora_images_sync_seq', 'sync_seq', 'id'),
+    )
+    
+    # On MySQL the table is partitioned by month on date with primary key (id, date);
+    # id alone stays unique (AUTO_INCREMENT) and is the ORM identity
+    id = db.Column(db.Integer, primary_key=True)
+    # Legacy MEDIUMBLOB; new images live in the blob store and leave this NULL.
+    # Deferred so metadata queries never read blob pages.
+    image = deferred(db.Column(db.LargeBinary(length=16777215), nullable=True))
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 hex digest in the blob store
+    size = db.Column(db.Integer)
+    image_format = db.Column(db.String(16))  # PNG, JPEG, ...
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    # pending until a full decode has checked the image, then verified or corrupt
+    verification_status = db.Column(db.String(16), default='pending', nullable=False, index=True)
+    label_name = db.Column(db.String(255), nullable=False)
+    date = db.Column(db.Date, default=lambda: datetime.utcnow().date(), nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Commit position for sync cursors, set just before commit (see stamp_sync_positions)
+    sync_seq = db.Column(db.BigInteger, nullable=False, server_default='0')
+    
+    def get_image_bytes(self):
+        """Return the image bytes from the blob store or the legacy column"""
+        if self.content_hash:
+            return get_blob_store().get(self.content_hash)
+        # Only rows not yet moved by `flask migrate-blobs` load the deferred column
+        return self.image
+    
+    def to_dict(self, include_image=False, thumbnail_size=None, thumbnail_format='webp'):
+        result = {
+            'id': self.id,
+            'label_name': self.label_name,
+            'content_hash': self.content_hash,
+            'size': self.size,
+            'image_format': self.image_format,
+            'width': self.width,
+            'height': self.height,
+            'verification_status': self.verification_status,
+            'date': self.date.isoformat() if self.date else None,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None
+        }
+        
+        # Only include image data if specifically requested (for performance)
+        if include_image:
+            image_bytes = self.get_image_bytes()
+            result['image'] = base64.b64encode(image_bytes).decode('utf-8') if image_bytes else None
+        
+        # Link a preview instead of (or as well as) the full image
+        if thumbnail_size:
+            result['thumbnail_url'] = f'/api/v1/images/{self.id}/thumbnail?size={thumbnail_size}&format={thumbnail_format}'
+            
+        return result
+
+class ImageBlob(db.Model):
+    """One row per distinct image payload; images reference it by content_hash"""
+    __tablename__ = 'singora_blobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class BackgroundJob(db.Model):
+    """Persisted job so queued work survives restarts (JOB_QUEUE_PERSISTENT)"""
+    __tablename__ = 'singora_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON encoded keyword arguments
+    status = db.Column(db.String(16), default='queued', nullable=False, index=True)  # queued, running, done, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+class ExportJob(db.Model):
+    """Archive export built in the background, reusable while its data is unchanged"""
+    __tablename__ = 'singora_exports'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    signature = db.Column(db.String(64), nullable=False, index=True)  # SHA-256 of filters + compression
+    filters = db.Column(db.Text, nullable=False)  # JSON encoded export filters
+    compression = db.Column(db.String(16), nullable=False)
+    fingerprint = db.Column(db.String(64))  # image count and max id the artifact was built from
+    # export_active_key() while queued or running, NULL afterwards; the unique index
+    # lets only one of several concurrent identical requests create a build
+    active_key = db.Column(db.String(64), unique=True, index=True)
+    status = db.Column(db.String(16), default='queued', nullable=False, index=True)  # queued, running, done, failed, expired
+    total_entries = db.Column(db.Integer)
+    processed_entries = db.Column(db.Integer, default=0, nullable=False)
+    file_name = db.Column(db.String(255))
+    download_name = db.Column(db.String(255))
+    size = db.Column(db.BigInteger)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # last sign of life: queued, claimed, or a progress commit
+    
+    def is_stale(self):
+        """True if a queued or running build has shown no progress for JOB_STALE_AFTER (its process is gone)"""
+        last_seen = self.heartbeat_at or self.started_at or self.created_at
+        stale_before = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_STALE_AFTER'])
+        return self.status in ('queued', 'running') and last_seen < stale_before
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'filters': json.loads(self.filters),
+            'compression': self.compression,
+            'progress': {
+                'processed': self.processed_entries,
+                'total': self.total_entries,
+                'percent': round(self.processed_entries * 100 / self.total_entries, 1) if self.total_entries else None
+            },
+            'size': self.size,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'download_url': f'/api/v1/exports/{self.id}/download' if self.status == 'done' else None
+        }
+
+class ImageTombstone(db.Model):
+    """Record of a deleted image, so sync clients can apply deletions (see /images/manifest)"""
+    __tablename__ = 'singora_tombstones'
+    __table_args__ = (
+        db.Index('ix_singora_tombstones_sync_seq', 'sync_seq', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(db.Integer, nullable=False)
+    label_name = db.Column(db.String(255), nullable=False, index=True)
+    date = db.Column(db.Date, nullable=False)
+    content_hash = db.Column(db.String(64))
+    size = db.Column(db.Integer)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sync_seq = db.Column(db.BigInteger, nullable=False, server_default='0')  # as ImageData.sync_seq
+    
+    def to_dict(self):
+        return {
+            'id': self.image_id,
+            'label_name': self.label_name,
+            'date': self.date.isoformat() if self.date else None,
+            'content_hash': self.content_hash,
+            'size': self.size,
+            'deleted_at': self.deleted_at.isoformat() if self.deleted_at else None
+        }
+
+class LabelDateStats(db.Model):
+    """Image counts per (label, date), kept in step with singora_images on every flush"""
+    __tablename__ = 'label_date_stats'
+    
+    label_name = db.Column(db.String(255), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    image_count = db.Column(db.Integer, nullable=False, default=0)
+
+def upsert_label_date_stats(connection, label_name, date, delta):
+    """Add delta to the (label_name, date) rollup row, creating or removing it as needed"""
+    table = LabelDateStats.__table__
+    if delta > 0:
+        if connection.dialect.name == 'mysql':
+            statement = mysql.insert(table).values(label_name=label_name, date=date, image_count=delta)
+            statement = statement.on_duplicate_key_update(
+                image_count=table.c.image_count + statement.inserted.image_count
+            )
+        else:
+            statement = sqlite.insert(table).values(label_name=label_name, date=date, image_count=delta)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.label_name, table.c.date],
+                set_={'image_count': table.c.image_count + statement.excluded.image_count}
+            )
+        connection.execute(statement)
+    elif delta < 0:
+        key = db.and_(table.c.label_name == label_name, table.c.date == date)
+        connection.execute(table.update().where(key).values(image_count=table.c.image_count + delta))
+        connection.execute(table.delete().where(key, table.c.image_count <= 0))
+
+@event.listens_for(db.session, 'after_flush')
+def update_label_date_stats(session, flush_context):
+    """Apply inserted/deleted images to label_date_stats in the same transaction"""
+    deltas = {}
+    for instance, delta in itertools.chain(
+        ((instance, 1) for instance in session.new),
+        ((instance, -1) for instance in session.deleted)
+    ):
+        if isinstance(instance, ImageData):
+            key = (instance.label_name, instance.date)
+            deltas[key] = deltas.get(key, 0) + delta
+    
+    if deltas:
+        connection = session.connection()
+        for (label_name, date), delta in deltas.items():
+            upsert_label_date_stats(connection, label_name, date, delta)
+
+@event.listens_for(db.session, 'after_flush')
+def record_tombstones(session, flush_context):
+    """Write a tombstone for every image deleted in this flush"""
+    tombstones = [
+        {
+            'image_id': instance.id,
+            'label_name': instance.label_name,
+            'date': instance.date,
+            'content_hash': instance.content_hash,
+            'size': instance.size,
+            'deleted_at': datetime.utcnow()
+        }
+        for instance in session.deleted if isinstance(instance, ImageData)
+    ]
+    if tombstones:
+        session.connection().execute(ImageTombstone.__table__.insert(), tombstones)
+
+class SyncSequence(db.Model):
+    """Named counters shared by every process: sync commit positions and the response cache generation"""
+    __tablename__ = 'singora_sync_sequences'
+    
+    name = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+SYNC_SEQUENCE = 'changes'
+
+def next_sync_position(connection):
+    """Allocate the next commit position; the counter row stays locked until the transaction ends.
+
+    Allocation is the last thing a transaction does before committing, so a
+    later position is only handed out once every earlier one is committed and
+    visible: a cursor can never move past a change that is still in flight,
+    as auto-increment ids (assigned at insert) can.
+    """
+    return increment_counter(connection, SYNC_SEQUENCE)
+
+def increment_counter(connection, name):
+    """Add one to the named counter (creating it at 1) and return the new value"""
+    table = SyncSequence.__table__
+    key = table.c.name == name
+    if connection.execute(table.update().where(key).values(value=table.c.value + 1)).rowcount == 0:
+        connection.execute(table.insert().values(name=name, value=1))
+    return connection.execute(db.select(table.c.value).where(key)).scalar()
+
+def read_counter(connection, name):
+    """Current value of the named counter (0 until first incremented)"""
+    table = SyncSequence.__table__
+    return connection.execute(db.select(table.c.value).where(table.c.name == name)).scalar() or 0
+
+def mark_sync_rows(session, image_ids=(), deleted_image_ids=()):
+    """Record images inserted and deleted (tombstoned) in this transaction, to be stamped at commit"""
+    rows = session.info.setdefault('sync_rows', {'images': set(), 'tombstones': set()})
+    rows['images'].update(image_ids)
+    rows['tombstones'].update(deleted_image_ids)
+
+@event.listens_for(db.session, 'after_flush')
+def collect_sync_rows(session, flush_context):
+    image_ids = [instance.id for instance in session.new if isinstance(instance, ImageData)]
+    deleted_image_ids = [instance.id for instance in session.deleted if isinstance(instance, ImageData)]
+    if image_ids or deleted_image_ids:
+        mark_sync_rows(session, image_ids, deleted_image_ids)
+
+@event.listens_for(db.session, 'before_commit')
+def stamp_sync_positions(session):
+    """Give this transaction's new images and tombstones its commit position"""
+    session.flush()
+    rows = session.info.pop('sync_rows', None)
+    if not rows:
+        return
+    
+    connection = session.connection()
+    position = next_sync_position(connection)
+    images, tombstones = ImageData.__table__, ImageTombstone.__table__
+    image_ids, deleted_image_ids = sorted(rows['images']), sorted(rows['tombstones'])
+    for start in range(0, len(image_ids), 1000):
+        connection.execute(images.update().where(
+            images.c.id.in_(image_ids[start:start + 1000])
+        ).values(sync_seq=position))
+    for start in range(0, len(deleted_image_ids), 1000):
+        connection.execute(tombstones.update().where(
+            tombstones.c.image_id.in_(deleted_image_ids[start:start + 1000]), tombstones.c.sync_seq == 0
+        ).values(sync_seq=position))
+
+@event.listens_for(db.session, 'after_transaction_end')
+def discard_sync_rows(session, transaction):
+    # Savepoint rollbacks keep the rows flushed before the savepoint; only the outer transaction ends them
+    if transaction.parent is None:
+        session.info.pop('sync_rows', None)
+
+def rebuild_label_date_stats(dry_run=False):
+    """Recount label_date_stats from singora_images.
+
+    Returns the number of (label, date) rows that were out of date. Unless
+    dry_run, the rollup is replaced with the recount in one transaction.
+    """
+    actual = {
+        (label_name, date): count
+        for label_name, date, count in db.session.query(
+            ImageData.label_name, ImageData.date, db.func.count(ImageData.id)
+        ).group_by(ImageData.label_name, ImageData.date)
+    }
+    recorded = {
+        (stat.label_name, stat.date): stat.image_count
+        for stat in LabelDateStats.query.all()
+    }
+    drift = sum(1 for key in set(actual) | set(recorded) if actual.get(key) != recorded.get(key))
+    
+    if not dry_run:
+        LabelDateStats.query.delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(LabelDateStats, [
+            {'label_name': label_name, 'date': date, 'image_count': count}
+            for (label_name, date), count in actual.items()
+        ])
+        db.session.commit()
+    else:
+        db.session.rollback()
+    
+    return drift
+
+# Utility functions
+def allowed_file(filename):
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# SOFn markers carry the frame dimensions; C4, C8 and CC share the range but are not frames
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Enough of a file to reach the JPEG frame header past large EXIF/ICC segments
+IMAGE_HEADER_BYTES = 256 * 1024
+
+def sniff_image_header(file_data):
+    """Read format and dimensions from a PNG/JPEG header without decoding.
+
+    Returns (format, width, height), or None if the header is not a
+    well-formed PNG or JPEG.
+    """
+    if file_data.startswith(PNG_SIGNATURE):
+        # The IHDR chunk must come first: length(4) type(4) width(4) height(4)
+        if len(file_data) < 33 or file_data[12:16] != b'IHDR':
+            return None
+        width, height = struct.unpack('>II', file_data[16:24])
+        return ('PNG', width, height) if width and height else None
+    
+    if file_data.startswith(b'\xff\xd8'):
+        offset = 2
+        while offset + 4 <= len(file_data):
+            if file_data[offset] != 0xFF:
+                return None
+            marker = file_data[offset + 1]
+            if marker == 0xFF:  # Fill byte
+                offset += 1
+                continue
+            if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # Standalone markers
+                offset += 2
+                continue
+            if marker == 0xDA:  # Start of scan before any frame header
+                return None
+            segment_length = struct.unpack('>H', file_data[offset + 2:offset + 4])[0]
+            if marker in JPEG_SOF_MARKERS:
+                if offset + 9 > len(file_data):
+                    return None
+                height, width = struct.unpack('>HH', file_data[offset + 5:offset + 9])
+                return ('JPEG', width, height) if width and height else None
+            offset += 2 + segment_length
+    
+    return None
+
+def verify_image_data(file_data):
+    """Fully decode-check image data (bytes or a seekable file) with PIL, returning (format, width, height) or None"""
+    try:
+        image = Image.open(file_data if hasattr(file_data, 'read') else io.BytesIO(file_data))
+        image_info = (image.format, image.width, image.height)
+        image.verify()  # Verify it's a valid image
+        return image_info
+    except Exception as e:
+        logger.warning("Invalid image data: %s", e)
+        return None
+
+def validate_image_data(file_data):
+    """Validate that the data is a valid image.
+
+    Returns the ImageData metadata columns (format, dimensions and
+    verification status) for a valid image, or None. In fast mode PNG/JPEG
+    uploads are only header-checked and left pending for `flask verify-images`;
+    other formats always get a full PIL verify. file_data may also be a
+    seekable file, of which fast mode reads only the first IMAGE_HEADER_BYTES.
+    """
+    started = time.perf_counter()
+    if current_app.config['IMAGE_VALIDATION_MODE'] == 'fast':
+        if hasattr(file_data, 'read'):
+            header = sniff_image_header(file_data.read(IMAGE_HEADER_BYTES))
+            file_data.seek(0)
+        else:
+            header = sniff_image_header(file_data)
+        if header:
+            image_validation_duration.observe(time.perf_counter() - started, endpoint=metrics_endpoint(), check='header')
+            image_format, width, height = header
+            return {'image_format': image_format, 'width': width, 'height': height,
+                    'verification_status': 'pending'}
+    
+    verified = verify_image_data(file_data)
+    if hasattr(file_data, 'seek'):
+        file_data.seek(0)
+    image_validation_duration.observe(time.perf_counter() - started, endpoint=metrics_endpoint(), check='full')
+    if not verified:
+        return None
+    image_format, width, height = verified
+    return {'image_format': image_format, 'width': width, 'height': height,
+            'verification_status': 'verified'}
+
+def order_key(clause):
+    """Split an order_by clause into (column, descending)"""
+    if getattr(clause, 'modifier', None) is operators.desc_op:
+        return clause.element, True
+    if getattr(clause, 'modifier', None) is operators.asc_op:
+        return clause.element, False
+    return clause, False
+
+def iter_bulk(query, order_by=(), batch_size=None):
+    """Iterate an ImageData query's rows in order_by order, one bounded batch at a time.
+
+    Pages by keyset on the order_by columns plus id, so no cursor stays open
+    while the caller writes to a slow client. The read-only transaction is
+    ended after each batch, returning the pooled connection; the batch's rows
+    are detached first and keep their loaded columns.
+    """
+    batch_size = batch_size or current_app.config['BULK_FETCH_BATCH_SIZE']
+    keys = [order_key(clause) for clause in order_by] + [(ImageData.id, False)]
+    ordering = [column.desc() if descending else column for column, descending in keys]
+    # Legacy rows still keep their bytes inline; load them with the batch, since
+    # detached rows cannot lazy-load the deferred column later
+    query = query.options(undefer(ImageData.image)).order_by(None).order_by(*ordering)
+    
+    last = None
+    while True:
+        page = query
+        if last is not None:
+            # (c1, c2, ..., id) strictly after the last row, each column in its own direction
+            seek, equal = [], []
+            for column, descending in keys:
+                value = getattr(last, column.key)
+                seek.append(db.and_(*equal, column < value if descending else column > value))
+                equal.append(column == value)
+            page = page.filter(db.or_(*seek))
+        images = page.limit(batch_size).all()
+        for image in images:
+            db.session.expunge(image)
+        db.session.rollback()
+        if not images:
+            return
+        
+        yield from images
+        if len(images) < batch_size:
+            return
+        last = images[-1]
+
+def decode_base64_image(image_data):
+    """Decode base64 image data, stripping a data URL prefix if present"""
+    if image_data.startswith('data:image'):
+        image_data = image_data.split(',', 1)[1]
+    return base64.b64decode(image_data)
+
+def read_and_hash(stream, chunk_size=64 * 1024):
+    """Read a file stream in chunks, returning (data, sha256 hex digest)"""
+    hasher = hashlib.sha256()
+    buffer = io.BytesIO()
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        hasher.update(chunk)
+        buffer.write(chunk)
+    return buffer.getvalue(), hasher.hexdigest()
+
+def spool_upload(stream, max_size, chunk_size=64 * 1024):
+    """Copy a request body into a spooled temp file, hashing and sizing it on the way.
+
+    Returns (rewound file, sha256 hex digest, size); raises ValueError once
+    more than max_size bytes arrive.
+    """
+    hasher = hashlib.sha256()
+    spooled = tempfile.SpooledTemporaryFile(max_size=current_app.config['INGEST_SPOOL_BYTES'])
+    size = 0
+    try:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            size += len(chunk)
+            if size > max_size:
+                raise ValueError('File too large')
+            hasher.update(chunk)
+            spooled.write(chunk)
+    except Exception:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return spooled, hasher.hexdigest(), size
+
+def reference_blob(file_data, content_hash):
+    """Add a reference to the blob for content_hash, storing the bytes if new.
+
+    file_data may be bytes or a seekable file, which is streamed to the blob
+    store. Runs inside the caller's transaction. Returns True when the payload
+    was already stored and only a reference was added (deduplicated).
+    """
+    def increment():
+        return ImageBlob.query.filter_by(content_hash=content_hash).update(
+            {ImageBlob.ref_count: ImageBlob.ref_count + 1}, synchronize_session=False
+        )
+    
+    if increment():
+        return True
+    
+    if hasattr(file_data, 'read'):
+        file_data.seek(0, os.SEEK_END)
+        size = file_data.tell()
+        file_data.seek(0)
+    else:
+        size = len(file_data)
+    try:
+        with db.session.begin_nested():
+            db.session.add(ImageBlob(content_hash=content_hash, size=size, ref_count=1))
+    except IntegrityError:
+        # A concurrent upload registered the same payload first
+        increment()
+        return True
+    
+    # Store the bytes only once the row exists: discard_blob() locks that row before
+    # unlinking, so it either waits for this transaction or has finished unlinking
+    if hasattr(file_data, 'read'):
+        get_blob_store().put_stream(file_data, content_hash)
+    else:
+        get_blob_store().put(file_data, content_hash)
+    return False
+
+def reference_blobs(payloads):
+    """Bulk variant of reference_blob for a batch of (content_hash, file_data).
+
+    Returns one deduplicated flag per payload, in order. A payload counts as
+    deduplicated if its bytes were already stored or appear earlier in the batch.
+    """
+    counts = {}
+    for content_hash, _ in payloads:
+        counts[content_hash] = counts.get(content_hash, 0) + 1
+    
+    candidates = {
+        content_hash for (content_hash,) in
+        db.session.query(ImageBlob.content_hash).filter(ImageBlob.content_hash.in_(list(counts)))
+    }
+    # Lock rows in a fixed order so overlapping batches can't deadlock; a row deleted
+    # since the SELECT (its last image went) updates nothing and is stored as new
+    existing = set()
+    for content_hash in sorted(candidates):
+        if ImageBlob.query.filter_by(content_hash=content_hash).update(
+            {ImageBlob.ref_count: ImageBlob.ref_count + counts[content_hash]}, synchronize_session=False
+        ):
+            existing.add(content_hash)
+    
+    flags = []
+    new_blobs = {}
+    for content_hash, file_data in payloads:
+        flags.append(content_hash in existing or content_hash in new_blobs)
+        if content_hash not in existing and content_hash not in new_blobs:
+            new_blobs[content_hash] = file_data
+    
+    if new_blobs:
+        try:
+            with db.session.begin_nested():
+                db.session.bulk_insert_mappings(ImageBlob, [
+                    {'content_hash': content_hash, 'size': len(file_data), 'ref_count': counts[content_hash],
+                     'created_at': datetime.utcnow()}
+                    for content_hash, file_data in new_blobs.items()
+                ])
+        except IntegrityError:
+            # A concurrent upload registered some of these payloads first
+            for content_hash, file_data in sorted(new_blobs.items()):
+                if ImageBlob.query.filter_by(content_hash=content_hash).update(
+                    {ImageBlob.ref_count: ImageBlob.ref_count + counts[content_hash]}, synchronize_session=False
+                ) == 0:
+                    db.session.add(ImageBlob(content_hash=content_hash, size=len(file_data), ref_count=counts[content_hash]))
+        
+        # After the rows, as in reference_blob(); put() skips bytes that are already stored
+        for content_hash, file_data in new_blobs.items():
+            get_blob_store().put(file_data, content_hash)
+    
+    return flags
+
+def release_blob(content_hash):
+    """Drop one reference to a blob inside the caller's transaction.
+
+    Returns True if that was the last reference; the caller deletes the bytes
+    from the blob store after committing.
+    """
+    ImageBlob.query.filter_by(content_hash=content_hash).update(
+        {ImageBlob.ref_count: ImageBlob.ref_count - 1}, synchronize_session=False
+    )
+    return ImageBlob.query.filter(
+        ImageBlob.content_hash == content_hash, ImageBlob.ref_count <= 0
+    ).delete(synchronize_session=False) > 0
+
+def discard_blob(content_hash):
+    """Delete a released blob's bytes and thumbnails, unless it was referenced again.
+
+    Runs after the releasing commit, in its own transaction. The ImageBlob row
+    (or, when absent, its index gap) is locked while unlinking, so a concurrent
+    upload of the same payload either re-creates the row first and the bytes
+    are kept, or waits and stores the bytes again after they are gone.
+    """
+    if ImageBlob.query.filter_by(content_hash=content_hash).with_for_update().first() is None:
+        get_blob_store().delete(content_hash)
+        get_thumbnail_cache().invalidate(content_hash)
+    db.session.commit()
+
+def enqueue_post_upload_jobs(image_record):
+    """Queue derived work for a freshly inserted (flushed) image"""
+    if image_record.verification_status == 'pending':
+        job_queue.enqueue('verify_image', image_id=image_record.id)
+
+def with_app_context(f):
+    """Wrap f to run inside the current app's context, e.g. on a pool thread.
+
+    The caller's read routing (use_replica), metrics endpoint label and
+    request ID carry over to the new context.
+    """
+    app = current_app._get_current_object()
+    replica = g.get('use_replica', False)
+    endpoint = metrics_endpoint()
+    request_id = g.get('request_id')
+    
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            g.use_replica = replica
+            g.metrics_endpoint = endpoint
+            g.request_id = request_id
+            return f(*args, **kwargs)
+    return wrapper
+
+def create_validation_pool(config):
+    """Thread pool used to validate batch uploads"""
+    return ThreadPoolExecutor(max_workers=config['BATCH_VALIDATION_WORKERS'], thread_name_prefix='validate')
+
+def get_validation_pool():
+    """Return the current app's batch validation pool"""
+    return current_app.extensions['singora_validation_pool']
+
+# Keyset pagination
+def encode_cursor(image):
+    """Opaque cursor pointing just after image in (timestamp, id) descending order"""
+    position = json.dumps([image.timestamp.isoformat(), image.id])
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, image_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(timestamp), int(image_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def paginate_keyset(query, cursor=None, per_page=20, include_total=False):
+    """Fetch one page of a query newest first, seeking past the cursor.
+
+    Each page costs O(per_page) regardless of depth; COUNT(*) only runs when
+    include_total is set. Returns (items, pagination dict).
+    """
+    total = query.order_by(None).count() if include_total else None
+    
+    if cursor:
+        timestamp, image_id = decode_cursor(cursor)
+        query = query.filter(db.or_(
+            ImageData.timestamp < timestamp,
+            db.and_(ImageData.timestamp == timestamp, ImageData.id < image_id)
+        ))
+    
+    items = query.order_by(ImageData.timestamp.desc(), ImageData.id.desc()).limit(per_page + 1).all()
+    has_next = len(items) > per_page
+    items = items[:per_page]
+    
+    pagination = {
+        'per_page': per_page,
+        'has_next': has_next,
+        'next_cursor': encode_cursor(items[-1]) if has_next else None
+    }
+    if include_total:
+        pagination['total'] = total
+    return items, pagination
+
+def keyset_args(default_per_page, max_per_page):
+    """Read cursor, per_page and include_total from the query string"""
+    return (
+        request.args.get('cursor'),
+        max(1, min(request.args.get('per_page', default_per_page, type=int), max_per_page)),
+        request.args.get('include_total', 'false').lower() == 'true'
+    )
+
+# Incremental sync
+def parse_since(value):
+    """Parse a since watermark: an image id, an ISO-8601 timestamp (UTC), or a manifest cursor.
+
+    Returns an int, a datetime, or a (sync_seq, id) tuple. Raises ValueError.
+    """
+    if value.isdigit():
+        return int(value)
+    try:
+        since = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            return decode_sync_cursor(value)[0]
+        except ValueError:
+            raise ValueError('Invalid since. Use an image id, an ISO-8601 timestamp or a manifest cursor')
+    if since.tzinfo:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since
+
+def since_arg():
+    """Read ?since= from the query string (None if absent), raising ValueError if malformed"""
+    value = request.args.get('since')
+    return parse_since(value) if value else None
+
+def sync_position_after(model, position):
+    """Filter for rows committed after a (sync_seq, id) position"""
+    sync_seq, row_id = position
+    return db.or_(model.sync_seq > sync_seq, db.and_(model.sync_seq == sync_seq, model.id > row_id))
+
+def since_condition(since):
+    """Filter for images added after a parse_since() watermark"""
+    if isinstance(since, tuple):
+        return sync_position_after(ImageData, since)
+    if isinstance(since, int):
+        return ImageData.id > since
+    return ImageData.timestamp > since
+
+def encode_sync_cursor(image_position, tombstone_position):
+    """Opaque manifest cursor: the (sync_seq, id) of the last image and tombstone the client has seen"""
+    position = json.dumps([list(image_position), list(tombstone_position)])
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_sync_cursor(cursor):
+    """Decode a cursor from encode_sync_cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        image_position, tombstone_position = json.loads(base64.urlsafe_b64decode(padded))
+        if isinstance(image_position, int):
+            # Cursors from before commit positions held plain ids; those rows all have sync_seq 0
+            return (0, int(image_position)), (0, int(tombstone_position))
+        return tuple(int(value) for value in image_position), tuple(int(value) for value in tombstone_position)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+# Streaming ZIP helpers
+class ZipStreamBuffer(io.RawIOBase):
+    """Unseekable write target so zipfile emits the archive incrementally"""
+
+    def __init__(self):
+        super().__init__()
+        self._pending = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._pending.extend(data)
+        return len(data)
+
+    def drain(self):
+        """Return and clear everything written since the last drain"""
+        data = bytes(self._pending)
+        self._pending.clear()
+        return data
+
+def stream_zip(entries, compression=zipfile.ZIP_DEFLATED, chunk_size=1024 * 1024):
+    """Yield a ZIP archive chunk by chunk from (filename, data) entries.
+
+    Each entry is flushed to the client as soon as it is written, so only
+    the current entry is held in memory regardless of archive size. data may
+    be bytes or a readable file object, which is copied in chunk_size pieces.
+    """
+    buffer = ZipStreamBuffer()
+    try:
+        with zipfile.ZipFile(buffer, 'w', compression) as zip_file:
+            for filename, data in entries:
+                if hasattr(data, 'read'):
+                    with zip_file.open(filename, 'w', force_zip64=True) as entry:
+                        for piece in iter(lambda: data.read(chunk_size), b''):
+                            entry.write(piece)
+                            chunk = buffer.drain()
+                            if chunk:
+                                yield chunk
+                else:
+                    zip_file.writestr(filename, data)
+                chunk = buffer.drain()
+                if chunk:
+                    yield chunk
+        yield buffer.drain()
+    except Exception as e:
+        logger.error("ZIP stream error: %s", e)
+        raise
+
+def peek_rows(rows):
+    """Return an iterator over rows, or None if there are no rows"""
+    iterator = iter(rows)
+    try:
+        first = next(iterator)
+    except StopIteration:
+        return None
+    return itertools.chain([first], iterator)
+
+def zip_response(entries, download_filename, compression=zipfile.ZIP_DEFLATED):
+    """Build a chunked ZIP download response from (filename, data) entries"""
+    chunks = observe_stream(
+        stream_zip(entries, compression), archive_build_duration,
+        endpoint=metrics_endpoint(), compression='deflate' if compression == zipfile.ZIP_DEFLATED else 'stored'
+    )
+    response = Response(stream_with_context(chunks), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename=download_filename)
+    return response
+
+def stream_tar_zstd(entries, level=3):
+    """Yield a zstd-compressed tar archive chunk by chunk from (filename, data) entries"""
+    buffer = ZipStreamBuffer()
+    compressor = zstandard.ZstdCompressor(level=level)
+    writer = compressor.stream_writer(buffer, closefd=False)
+    try:
+        with tarfile.open(fileobj=writer, mode='w|') as tar:
+            for filename, data in entries:
+                if hasattr(data, 'read'):
+                    # tar headers need the size up front
+                    data.seek(0, os.SEEK_END)
+                    size = data.tell()
+                    data.seek(0)
+                else:
+                    size = len(data)
+                    data = io.BytesIO(data)
+                info = tarfile.TarInfo(filename)
+                info.size = size
+                info.mtime = int(time.time())
+                tar.addfile(info, data)
+                writer.flush(zstandard.FLUSH_BLOCK)
+                chunk = buffer.drain()
+                if chunk:
+                    yield chunk
+        writer.flush(zstandard.FLUSH_FRAME)
+        yield buffer.drain()
+    except Exception as e:
+        logger.error("tar.zst stream error: %s", e)
+        raise
+
+# Archive compression modes: ZIP compress_type, or None for the tar.zst container
+ARCHIVE_COMPRESSIONS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'zstd': None
+}
+
+def archive_compression_arg():
+    """Read ?compression= (stored/deflate/zstd), raising ValueError if unusable"""
+    return check_archive_compression(request.args.get('compression'))
+
+def check_archive_compression(compression):
+    """Normalise a compression mode (None for the default), raising ValueError if unusable"""
+    compression = (compression or current_app.config['ARCHIVE_DEFAULT_COMPRESSION']).lower()
+    if compression not in ARCHIVE_COMPRESSIONS:
+        raise ValueError(f"Invalid compression. Use one of: {', '.join(ARCHIVE_COMPRESSIONS)}")
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError('zstd compression is not available on this server')
+    return compression
+
+def archive_response(entries, download_basename, compression):
+    """Stream entries as a ZIP (stored/deflate) or tar.zst (zstd) download"""
+    if compression == 'zstd':
+        chunks = observe_stream(
+            stream_tar_zstd(entries, current_app.config['ARCHIVE_ZSTD_LEVEL']), archive_build_duration,
+            endpoint=metrics_endpoint(), compression='zstd'
+        )
+        response = Response(stream_with_context(chunks), mimetype='application/zstd')
+        response.headers.set('Content-Disposition', 'attachment', filename=f"{download_basename}.tar.zst")
+        return response
+    return zip_response(entries, f"{download_basename}.zip", ARCHIVE_COMPRESSIONS[compression])
+
+def build_label_archive(label_name, compression=zipfile.ZIP_STORED, since=None):
+    """Build one label's ZIP of images in a spooled temp file (run on a worker thread).
+
+    Entries are stored without compression by default since JPEG/PNG data is
+    already compressed. Returns the rewound file, or None if the label has no images.
+    """
+    conditions, order_by, entry_name = archive_scope('label', label_name=label_name, since=since)
+    images = peek_rows(iter_bulk(ImageData.query.filter(*conditions), order_by))
+    if not images:
+        return None
+    
+    archive = tempfile.SpooledTemporaryFile(max_size=current_app.config['ARCHIVE_SPOOL_BYTES'])
+    with zipfile.ZipFile(archive, 'w', compression) as label_zip:
+        for filename, image_bytes in image_entries(images, entry_name):
+            label_zip.writestr(filename, image_bytes)
+    archive.seek(0)
+    return archive
+
+def build_label_archives_parallel(label_names, compression=zipfile.ZIP_STORED, since=None):
+    """Yield (label_name, archive file) as per-label archives finish on a thread pool.
+
+    At most ARCHIVE_WORKERS archives are in flight, so finished archives
+    waiting for a slow client never pile up beyond that.
+    """
+    workers = current_app.config['ARCHIVE_WORKERS']
+    remaining = iter(label_names)
+    build = with_app_context(build_label_archive)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='archive') as pool:
+        pending = {}
+        
+        def fill():
+            for label_name in itertools.islice(remaining, workers - len(pending)):
+                pending[pool.submit(build, label_name, compression, since)] = label_name
+        
+        try:
+            fill()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    label_name = pending.pop(future)
+                    archive = future.result()
+                    if archive is not None:
+                        with archive:
+                            yield label_name, archive
+                fill()
+        finally:
+            # Client went away or a build failed: drop queued builds, close finished ones
+            for future in pending:
+                future.cancel()
+            for future in pending:
+                if not future.cancelled() and future.exception() is None and future.result() is not None:
+                    future.result().close()
+
+# Streaming NDJSON listings
+def stream_ndjson(images, include_image=True, thumbnail_size=None, chunk_size=3 * 64 * 1024):
+    """Yield one JSON record per image and line, base64-encoding image bytes chunk by chunk.
+
+    chunk_size is a multiple of 3 so the encoded chunks join without padding.
+    """
+    for image in images:
+        record = image.to_dict(thumbnail_size=thumbnail_size)
+        image_bytes = image.get_image_bytes() if include_image else None
+        if not image_bytes:
+            if include_image:
+                record['image'] = None
+            yield json.dumps(record) + '\n'
+            continue
+        
+        # Close the record by hand so the base64 text is never built as one string
+        yield json.dumps(record)[:-1] + ', "image": "'
+        view = memoryview(image_bytes)
+        for start in range(0, len(view), chunk_size):
+            yield base64.b64encode(view[start:start + chunk_size]).decode('ascii')
+        yield '"}\n'
+
+def ndjson_response(images, thumbnail_size=None):
+    """Stream images as application/x-ndjson, embedding full images unless thumbnails are asked for"""
+    return Response(
+        stream_with_context(stream_ndjson(images, include_image=not thumbnail_size, thumbnail_size=thumbnail_size)),
+        mimetype='application/x-ndjson'
+    )
+
+# Archive scopes shared by the download routes and background exports
+ARCHIVE_SCOPES = ('all', 'label', 'date', 'label_date', 'date_range')
+
+def archive_scope(scope, label_name=None, date=None, date_from=None, date_to=None, organize_by_date=True, since=None):
+    """Return (filter conditions, ordering, entry filename function) for a download scope.
+
+    since (a parse_since() watermark) limits the scope to images added after it.
+    """
+    if scope == 'all':
+        conditions, order_by, entry_name = [], [ImageData.label_name], None
+    
+    elif scope == 'label':
+        # Timestamp and id keep names unique within the label
+        conditions = [ImageData.label_name == label_name]
+        order_by = [ImageData.timestamp.desc()]
+        entry_name = lambda image: f"{image.timestamp.strftime('%Y%m%d_%H%M%S')}_{image.id}.jpg"
+    
+    elif scope == 'date':
+        # Folder per label; the time is enough since the date is fixed
+        conditions = [ImageData.date == date]
+        if label_name:
+            conditions.append(ImageData.label_name == label_name)
+        order_by = [ImageData.label_name, ImageData.timestamp]
+        entry_name = lambda image: f"{image.label_name}/{image.timestamp.strftime('%H%M%S')}_{image.id}.jpg"
+    
+    elif scope == 'label_date':
+        conditions = [ImageData.label_name == label_name, ImageData.date == date]
+        order_by = [ImageData.timestamp.desc()]
+        entry_name = lambda image: f"{image.timestamp.strftime('%H%M%S')}_{image.id}.jpg"
+    
+    elif scope == 'date_range':
+        conditions = [ImageData.label_name == label_name, ImageData.date >= date_from, ImageData.date <= date_to]
+        order_by = [ImageData.date, ImageData.timestamp]
+        if organize_by_date:
+            # Date folders: 2024-01-15/143022_123.jpg
+            entry_name = lambda image: f"{image.date.isoformat()}/{image.timestamp.strftime('%H%M%S')}_{image.id}.jpg"
+        else:
+            # Flat structure with date in filename: 20240115_143022_123.jpg
+            entry_name = lambda image: f"{image.timestamp.strftime('%Y%m%d_%H%M%S')}_{image.id}.jpg"
+    
+    else:
+        raise ValueError(f"Invalid scope. Use one of: {', '.join(ARCHIVE_SCOPES)}")
+    
+    if since is not None:
+        conditions.append(since_condition(since))
+    return conditions, order_by, entry_name
+
+def image_entries(images, entry_name):
+    """Yield (filename, bytes) archive entries for images, skipping rows without data"""
+    for image in images:
+        image_bytes = image.get_image_bytes()
+        if image_bytes:
+            yield entry_name(image), image_bytes
+
+# Thumbnails
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png')
+}
+
+def thumbnail_size_arg():
+    """Read ?thumbnail_size= (None if absent), raising ValueError unless it is in THUMBNAIL_SIZES"""
+    size = request.args.get('thumbnail_size', type=int)
+    if size is not None and size not in current_app.config['THUMBNAIL_SIZES']:
+        raise ValueError(f"Unsupported thumbnail_size. Use one of {sorted(current_app.config['THUMBNAIL_SIZES'])}")
+    return size
+
+def render_thumbnail(file_data, size, thumbnail_format):
+    """Resize image data to fit within size x size and encode it"""
+    pil_format, _ = THUMBNAIL_FORMATS[thumbnail_format]
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(file_data)))
+    image.thumbnail((size, size))
+    if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, pil_format, quality=85)
+    return output.getvalue()
+
+class ThumbnailCache:
+    """Two-level cache of rendered thumbnails keyed by content hash.
+
+    Entries live on disk under THUMBNAIL_CACHE_FOLDER (evicting the least
+    recently used files once THUMBNAIL_DISK_CACHE_BYTES is exceeded) and in an
+    in-memory LRU capped at THUMBNAIL_MEMORY_CACHE_BYTES.
+    """
+
+    def __init__(self):
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None
+        self._evicting = False
+        self._lock = threading.Lock()
+
+    @property
+    def root(self):
+        return os.path.abspath(current_app.config['THUMBNAIL_CACHE_FOLDER'])
+
+    def _path(self, content_hash, size, thumbnail_format):
+        return os.path.join(self.root, content_hash[:2], f"{content_hash}_{size}.{thumbnail_format}")
+
+    def _remember(self, key, data):
+        limit = current_app.config['THUMBNAIL_MEMORY_CACHE_BYTES']
+        if len(data) > limit:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= len(self._memory.pop(key))
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > limit:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def get(self, content_hash, size, thumbnail_format, load_source):
+        """Return thumbnail bytes, rendering from load_source() on a miss"""
+        key = (content_hash, size, thumbnail_format)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+        
+        path = self._path(content_hash, size, thumbnail_format)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # Mark as recently used for disk eviction
+        except FileNotFoundError:
+            data = render_thumbnail(load_source(), size, thumbnail_format)
+            self._store(path, data)
+        
+        self._remember(key, data)
+        return data
+
+    def _store(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data)
+            disk_bytes = self._disk_bytes
+        if disk_bytes is None:
+            # First write: size the existing cache (this file included) outside the lock
+            disk_bytes = sum(size for _, size, _ in self._disk_entries())
+            with self._lock:
+                if self._disk_bytes is None:
+                    self._disk_bytes = disk_bytes
+        if disk_bytes > current_app.config['THUMBNAIL_DISK_CACHE_BYTES']:
+            self._evict_disk()
+
+    def _disk_entries(self):
+        """(path, size, mtime) of each cached file, skipping files removed while walking"""
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _evict_disk(self):
+        """Delete least recently used files until the disk cache is back at 90% of its limit.
+
+        Runs outside the lock, one thread at a time, so cache hits never wait on the walk.
+        """
+        with self._lock:
+            if self._evicting:
+                return
+            self._evicting = True
+            counted = self._disk_bytes
+        total = None
+        try:
+            entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            target = current_app.config['THUMBNAIL_DISK_CACHE_BYTES'] * 0.9
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                    total -= size
+                except OSError:
+                    pass
+        finally:
+            with self._lock:
+                self._evicting = False
+                if total is not None:
+                    # Resync with the disk, keeping writes and invalidations made while evicting
+                    self._disk_bytes = max(0, total + self._disk_bytes - counted)
+
+    def invalidate(self, content_hash):
+        """Drop every cached variant of the given content"""
+        with self._lock:
+            for key in [key for key in self._memory if key[0] == content_hash]:
+                self._memory_bytes -= len(self._memory.pop(key))
+        
+        directory = os.path.join(self.root, content_hash[:2])
+        removed = 0
+        if os.path.isdir(directory):
+            for filename in os.listdir(directory):
+                if filename.startswith(f"{content_hash}_"):
+                    path = os.path.join(directory, filename)
+                    try:
+                        size = os.path.getsize(path)
+                        os.unlink(path)
+                        removed += size
+                    except OSError:
+                        pass
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes = max(0, self._disk_bytes - removed)
+
+def get_thumbnail_cache():
+    """Return the current app's thumbnail cache"""
+    return current_app.extensions['singora_thumbnail_cache']
+
+# Response cache
+class MemoryCacheBackend:
+    """Per-process TTL + LRU cache.
+
+    Entries stay in the process, but counters live in singora_sync_sequences,
+    so a bump from any gunicorn worker or CLI command reaches every worker.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def counter(self, key):
+        return read_counter(db.session.connection(), key)
+
+    def incr(self, key):
+        try:
+            value = increment_counter(db.session.connection(), key)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return value
+
+class RedisCacheBackend:
+    """Cache shared by all workers through a Redis-compatible server"""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('redis is required for the redis response cache backend')
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(f"singora:{key}")
+
+    def set(self, key, value, ttl):
+        self.client.setex(f"singora:{key}", ttl, value)
+
+    def counter(self, key):
+        self.client.set(f"singora:{key}", int(time.time() * 1000), nx=True)
+        return int(self.client.get(f"singora:{key}"))
+
+    def incr(self, key):
+        self.counter(key)
+        return self.client.incr(f"singora:{key}")
+
+class ResponseCache:
+    """Caches JSON responses keyed by a data generation number.
+
+    Writes that change images bump the generation, which makes every earlier
+    cache entry stale at once, so no explicit purge is needed. The ETag is a
+    hash of the body, so a revalidation only gets 304 for identical data.
+    """
+
+    GENERATION_KEY = 'response_cache'
+
+    @staticmethod
+    def create_backend(config):
+        """Build the backend selected by RESPONSE_CACHE_BACKEND"""
+        if config['RESPONSE_CACHE_BACKEND'] == 'redis':
+            return RedisCacheBackend(config['REDIS_URL'])
+        return MemoryCacheBackend(config['RESPONSE_CACHE_MAX_ENTRIES'])
+
+    @property
+    def backend(self):
+        return current_app.extensions['singora_response_cache']
+
+    def generation(self):
+        return self.backend.counter(self.GENERATION_KEY)
+
+    def bump(self):
+        """Invalidate all cached responses after images were added or removed"""
+        try:
+            self.backend.incr(self.GENERATION_KEY)
+        except Exception as e:
+            logger.error("Response cache invalidation failed: %s", e)
+
+    def cached(self, f):
+        """Cache a JSON view per generation and query string, answering If-None-Match with 304.
+
+        The view always reads from the primary: the generation is bumped right
+        after the primary commit, so a lagging replica could still return older
+        data that would then be cached under the new generation.
+        """
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            g.use_replica = False
+            try:
+                generation = self.generation()
+            except Exception as e:
+                logger.error("Response cache unavailable: %s", e)
+                return f(*args, **kwargs)
+            
+            key = f"response:{generation}:{request.endpoint}:{request.query_string.decode('utf-8')}"
+            body = self.backend.get(key)
+            if body is None:
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                self.backend.set(key, body, current_app.config['RESPONSE_CACHE_TTL'])
+            
+            etag = hashlib.sha1(body).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = Response(body, mimetype='application/json')
+            response.set_etag(etag)
+            response.cache_control.no_cache = True  # Clients revalidate with the ETag
+            return response
+        return decorated_function
+
+response_cache = ResponseCache()
+
+# Background jobs
+def percentile(values, pct):
+    """Nearest-rank percentile of a sequence, or None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def latency_summary(values):
+    """p50/p95/max in milliseconds of a sequence of durations in seconds"""
+    values = list(values)
+    return {
+        'p50_ms': round(percentile(values, 50) * 1000, 2) if values else None,
+        'p95_ms': round(percentile(values, 95) * 1000, 2) if values else None,
+        'max_ms': round(max(values) * 1000, 2) if values else None
+    }
+
+class JobQueueState:
+    """Runtime state of the job queue for one app: its queue, workers and counters"""
+
+    def __init__(self, app):
+        self.app = app
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.workers = []
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_times = deque(maxlen=1000)
+        self.run_times = deque(maxlen=1000)
+        self.recent_failures = deque(maxlen=20)
+
+class JobQueue:
+    """In-process job queue served by a pool of worker threads.
+
+    Jobs enqueued inside a request are handed to the workers only after the
+    surrounding transaction commits, so a job never runs against rows that
+    were rolled back. With JOB_QUEUE_PERSISTENT each job is also written to
+    singora_jobs in that same transaction and re-queued after a restart.
+    Handlers are registered here once; each app keeps its own JobQueueState.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.start_hooks = []
+
+    @property
+    def state(self):
+        return current_app.extensions['singora_job_queue']
+
+    def handler(self, job_type):
+        """Register a function as the handler for job_type"""
+        def decorator(f):
+            self.handlers[job_type] = f
+            return f
+        return decorator
+
+    def on_start(self, f):
+        """Register a function run (in an app context) when the workers start, to recover lost work"""
+        self.start_hooks.append(f)
+        return f
+
+    def enqueue(self, job_type, **payload):
+        """Queue a job to run once the current transaction commits"""
+        job = {'job_type': job_type, 'payload': payload, 'enqueued_at': time.time(), 'attempts': 0,
+               'request_id': g.get('request_id')}
+        if current_app.config['JOB_QUEUE_PERSISTENT']:
+            record = BackgroundJob(job_type=job_type, payload=json.dumps(payload))
+            db.session.add(record)
+            db.session.flush()
+            job['job_id'] = record.id
+        db.session.info.setdefault('pending_jobs', []).append(job)
+
+    def dispatch_pending(self, session):
+        jobs = session.info.pop('pending_jobs', [])
+        if jobs:
+            self.start()
+            for job in jobs:
+                self.state.queue.put(job)
+
+    def discard_pending(self, session):
+        session.info.pop('pending_jobs', None)
+
+    def start(self):
+        """Start the current app's worker threads (once per process) and recover persisted jobs"""
+        state = self.state
+        if state.workers:
+            return
+        with state.lock:
+            if state.workers:
+                return
+            # Workers run outside any request, so they push contexts for the state's app
+            for index in range(state.app.config['JOB_WORKERS']):
+                worker = threading.Thread(target=self._work, args=(state,), name=f'job-worker-{index}', daemon=True)
+                worker.start()
+                state.workers.append(worker)
+        threading.Thread(target=self._recover, args=(state,), name='job-recovery', daemon=True).start()
+
+    def _recover(self, state):
+        """Run the start hooks, then re-queue persisted jobs left queued, or stuck running, by a previous process"""
+        for hook in self.start_hooks:
+            try:
+                with state.app.app_context():
+                    hook()
+            except Exception as e:
+                logger.error("Job queue start hook %s failed: %s", hook.__name__, e)
+        if not state.app.config['JOB_QUEUE_PERSISTENT']:
+            return
+        try:
+            with state.app.app_context():
+                stale_before = datetime.utcnow().timestamp() - current_app.config['JOB_STALE_AFTER']
+                jobs = BackgroundJob.query.filter(BackgroundJob.status.in_(['queued', 'running'])).all()
+                for record in jobs:
+                    if record.status == 'running':
+                        if record.started_at and record.started_at.timestamp() > stale_before:
+                            continue
+                        record.status = 'queued'
+                    state.queue.put({
+                        'job_type': record.job_type,
+                        'payload': json.loads(record.payload),
+                        'enqueued_at': record.created_at.timestamp(),
+                        'attempts': record.attempts,
+                        'job_id': record.id
+                    })
+                db.session.commit()
+                if jobs:
+                    logger.info("Recovered %s persisted jobs", len(jobs))
+        except Exception as e:
+            logger.error("Job recovery failed: %s", e)
+
+    def _work(self, state):
+        while True:
+            job = state.queue.get()
+            try:
+                with state.app.app_context():
+                    self._run(state, job)
+            except Exception as e:
+                logger.error("Job worker error: %s", e)
+            finally:
+                state.queue.task_done()
 
+    def _claim(self, job):
+        """Mark a persisted job running; False if another worker already has it"""
+        claimed = BackgroundJob.query.filter(
+            BackgroundJob.id == job['job_id'], BackgroundJob.status == 'queued'
+        ).update({
+            BackgroundJob.status: 'running',
+            BackgroundJob.started_at: datetime.utcnow(),
+            BackgroundJob.attempts: BackgroundJob.attempts + 1
+        }, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
 
+    def _finish(self, job, status, error=None):
+        BackgroundJob.query.filter_by(id=job['job_id']).update({
+            BackgroundJob.status: status,
+            BackgroundJob.error: error,
+            BackgroundJob.finished_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
 
-# Initialize Flask app
-app = Flask(__name__)
+    def _run(self, state, job):
+        g.metrics_endpoint = f"job:{job['job_type']}"
+        g.request_id = job.get('request_id')  # logs of the job carry the ID of the request that queued it
+        persistent = 'job_id' in job
+        if persistent and not self._claim(job):
+            return
+        
+        started = time.time()
+        state.wait_times.append(started - job['enqueued_at'])
+        job['attempts'] += 1
+        status = 'done'
+        with state.lock:
+            state.running += 1
+        try:
+            handler = self.handlers[job['job_type']]
+            handler(**job['payload'])
+            db.session.commit()
+            if persistent:
+                self._finish(job, 'done')
+            with state.lock:
+                state.completed += 1
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Job %s failed (attempt %s): %s", job['job_type'], job['attempts'], e)
+            retry = job['attempts'] < current_app.config['JOB_MAX_ATTEMPTS']
+            status = 'retry' if retry else 'failed'
+            if persistent:
+                self._finish(job, 'queued' if retry else 'failed', str(e))
+            if retry:
+                state.queue.put(job)
+            else:
+                with state.lock:
+                    state.failed += 1
+                state.recent_failures.append({
+                    'job_type': job['job_type'],
+                    'payload': job['payload'],
+                    'error': str(e),
+                    'failed_at': datetime.utcnow().isoformat()
+                })
+        finally:
+            state.run_times.append(time.time() - started)
+            job_duration.observe(time.time() - started, job_type=job['job_type'], status=status)
+            with state.lock:
+                state.running -= 1
 
-# Configuration
-class Config:
-    # Database configuration
-    MYSQL_HOST = os.getenv('MYSQL_HOST', 'localhost')
-    MYSQL_USER = os.getenv('MYSQL_USER', 'root')
-    MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', 'root')
-    MYSQL_DATABASE = os.getenv('MYSQL_DATABASE', 'singora_db')
+    def stats(self):
+        state = self.state
+        return {
+            'workers': len(state.workers),
+            'persistent': current_app.config['JOB_QUEUE_PERSISTENT'],
+            'queue_depth': state.queue.qsize(),
+            'running': state.running,
+            'completed': state.completed,
+            'failed': state.failed,
+            'wait_latency': latency_summary(state.wait_times),
+            'run_latency': latency_summary(state.run_times),
+            'recent_failures': list(state.recent_failures)
+        }
+
+job_queue = JobQueue()
+event.listen(db.session, 'after_commit', job_queue.dispatch_pending)
+event.listen(db.session, 'after_rollback', job_queue.discard_pending)
+
+@api.before_app_request
+def start_job_queue():
+    # Persisted jobs and interrupted exports from a previous run are picked up once the worker serves traffic
+    job_queue.start()
+
+# Background exports
+EXPORT_DATE_FIELDS = ('date', 'date_from', 'date_to')
+
+def parse_export_request(body):
+    """Validate a POST /api/v1/exports body, returning (filters, compression). Raises ValueError."""
+    scope = body.get('scope')
+    if scope not in ARCHIVE_SCOPES:
+        raise ValueError(f"Invalid scope. Use one of: {', '.join(ARCHIVE_SCOPES)}")
     
-    SQLALCHEMY_DATABASE_URI = f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}/{MYSQL_DATABASE}'
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    filters = {'scope': scope}
+    if body.get('label_name'):
+        filters['label_name'] = body['label_name']
+    elif scope in ('label', 'label_date', 'date_range'):
+        raise ValueError(f'label_name is required for scope "{scope}"')
     
-    # File upload configuration
-    UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+    required = {'date': ['date'], 'label_date': ['date'], 'date_range': ['date_from', 'date_to']}.get(scope, [])
+    for field in required:
+        try:
+            filters[field] = datetime.strptime(str(body.get(field)), '%Y-%m-%d').date().isoformat()
+        except ValueError:
+            raise ValueError(f'{field} is required as YYYY-MM-DD for scope "{scope}"')
     
-    # Security
-    SECRET_KEY = os.getenv('SECRET_KEY', '12345')
-    API_KEY = os.getenv('API_KEY', '12345')
+    if scope == 'date_range':
+        if filters['date_from'] > filters['date_to']:
+            raise ValueError('date_from cannot be later than date_to')
+        filters['organize_by_date'] = bool(body.get('organize_by_date', True))
+    
+    if scope == 'all':
+        # download/all covers every label, so a label filter does not apply
+        filters.pop('label_name', None)
+    
+    if body.get('since') not in (None, ''):
+        parse_since(str(body['since']))
+        filters['since'] = str(body['since'])
+    
+    return filters, check_archive_compression(body.get('compression'))
 
-app.config.from_object(Config)
+def export_scope(filters):
+    """archive_scope() for stored export filters"""
+    kwargs = {
+        key: datetime.strptime(value, '%Y-%m-%d').date() if key in EXPORT_DATE_FIELDS else value
+        for key, value in filters.items() if key != 'scope'
+    }
+    if 'since' in kwargs:
+        kwargs['since'] = parse_since(kwargs['since'])
+    return archive_scope(filters['scope'], **kwargs)
 
-# Initialize extensions
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-CORS(app)
+def export_signature(filters, compression):
+    """Identify exports with the same filters and compression"""
+    canonical = json.dumps({'filters': filters, 'compression': compression}, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(name)s %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
+def export_fingerprint(filters):
+    """Summarise the rows an export covers; uploads and deletes both change it"""
+    conditions = export_scope(filters)[0]
+    count, max_id = db.session.query(db.func.count(ImageData.id), db.func.max(ImageData.id)).filter(*conditions).one()
+    return f"{count}:{max_id or 0}"
 
-# Database Models
-class ImageData(db.Model):
-    __tablename__ = 'singora_images'
+def export_basename(filters):
+    """Download filename (without extension) matching the synchronous download routes"""
+    scope = filters['scope']
+    if scope == 'all':
+        return 'all_images_by_labels'
+    if scope == 'label':
+        return filters['label_name']
+    if scope == 'date':
+        label_suffix = f"_{filters['label_name']}" if filters.get('label_name') else ""
+        return f"images_{filters['date']}{label_suffix}"
+    if scope == 'label_date':
+        return f"{filters['label_name']}_{filters['date']}"
+    return f"{filters['label_name']}_{filters['date_from']}_to_{filters['date_to']}"
+
+def export_path(export):
+    return os.path.join(current_app.config['EXPORT_FOLDER'], export.file_name)
+
+def export_active_key(signature, fingerprint):
+    """Unique key of an in-flight export of this data (see ExportJob.active_key)"""
+    return hashlib.sha256(f"{signature}:{fingerprint}".encode('utf-8')).hexdigest()
+
+def requeue_export(export):
+    """Queue the build of an export again (caller commits); claim_export() keeps duplicates from running"""
+    logger.warning("Export %s was %s with no progress since %s; requeueing it",
+                   export.id, export.status, export.heartbeat_at or export.created_at)
+    export.status = 'queued'
+    export.heartbeat_at = datetime.utcnow()
+    job_queue.enqueue('build_export', export_id=export.id)
+
+def find_reusable_export(signature, fingerprint):
+    """Return a finished or in-flight export of the same data, if one exists.
+
+    An in-flight export whose build was lost (stale heartbeat) is requeued
+    and returned rather than duplicated.
+    """
+    exports = ExportJob.query.filter(
+        ExportJob.signature == signature,
+        ExportJob.status.in_(['queued', 'running', 'done'])
+    ).order_by(ExportJob.id.desc()).limit(5).all()
+    for export in exports:
+        if export.fingerprint != fingerprint:
+            continue
+        if export.status == 'done' and os.path.exists(export_path(export)):
+            return export
+        if export.status != 'done':
+            if export.is_stale():
+                requeue_export(export)
+            return export
+    return None
+
+@job_queue.on_start
+def recover_exports():
+    """Requeue exports whose build died with a previous process (queue lost on restart, recycled worker)"""
+    exports = [export for export in ExportJob.query.filter(ExportJob.status.in_(['queued', 'running'])) if export.is_stale()]
+    for export in exports:
+        requeue_export(export)
+    db.session.commit()
+    if exports:
+        logger.info("Requeued %s interrupted exports", len(exports))
+
+def claim_export(export_id):
+    """Mark an export running for this build; False if it is finished or another live build has it"""
+    stale_before = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_STALE_AFTER'])
+    now = datetime.utcnow()
+    claimed = ExportJob.query.filter(
+        ExportJob.id == export_id,
+        db.or_(
+            # failed: a retry of this job after its previous attempt raised
+            ExportJob.status.in_(['queued', 'failed']),
+            db.and_(
+                ExportJob.status == 'running',
+                db.func.coalesce(ExportJob.heartbeat_at, ExportJob.started_at, ExportJob.created_at) < stale_before
+            )
+        )
+    ).update({
+        ExportJob.status: 'running',
+        ExportJob.started_at: now,
+        ExportJob.heartbeat_at: now
+    }, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+def export_entries(export, filters):
+    """Yield archive entries for an export, committing progress between batches.
+
+    Progress commits double as the build's heartbeat, so they are also made
+    at least every quarter of JOB_STALE_AFTER even when entries are slow.
+    """
+    conditions, order_by, entry_name = export_scope(filters)
+    interval = current_app.config['EXPORT_PROGRESS_INTERVAL']
+    heartbeat_every = current_app.config['JOB_STALE_AFTER'] / 4
     
-    id = db.Column(db.Integer, primary_key=True)
-    image = db.Column(db.LargeBinary(length=16777215), nullable=False)  # MEDIUMBLOB in MySQL
-    label_name = db.Column(db.String(255), nullable=False, index=True)
-    date = db.Column(db.Date, default=datetime.utcnow().date, nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    def report_progress():
+        export.heartbeat_at = datetime.utcnow()
+        db.session.commit()
     
-    def to_dict(self, include_image=False):
-        result = {
-            'id': self.id,
-            'label_name': self.label_name,
-            'date': self.date.isoformat() if self.date else None,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None
-        }
-        
-        # Only include image data if specifically requested (for performance)
-        if include_image:
-            result['image'] = base64.b64encode(self.image).decode('utf-8') if self.image else None
-            
-        return result
+    if filters['scope'] == 'all':
+        # Same layout as download/all: one label ZIP per entry, built in parallel
+        labels = [label for (label,) in db.session.query(ImageData.label_name).filter(*conditions).distinct().all()]
+        export.total_entries = len(labels)
+        report_progress()
+        inner_compression = zipfile.ZIP_DEFLATED if export.compression == 'deflate' else zipfile.ZIP_STORED
+        since = parse_since(filters['since']) if 'since' in filters else None
+        for label_name, archive in build_label_archives_parallel(labels, inner_compression, since):
+            yield f"{label_name}.zip", archive
+            export.processed_entries += 1
+            report_progress()
+        return
+    
+    # iter_bulk ends its transaction between batches, discarding unsaved changes, so
+    # progress is counted locally and only assigned to the export as it is committed
+    processed = reported = export.processed_entries
+    reported_at = time.monotonic()
+    for image in iter_bulk(ImageData.query.filter(*conditions), order_by):
+        yield from image_entries((image,), entry_name)
+        processed += 1
+        if processed - reported >= interval or time.monotonic() - reported_at >= heartbeat_every:
+            export.processed_entries = processed
+            report_progress()
+            reported = processed
+            reported_at = time.monotonic()
+    export.processed_entries = processed
 
-# Utility functions
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+def remove_export_artifact(export, status='expired'):
+    if export.file_name:
+        try:
+            os.remove(export_path(export))
+        except FileNotFoundError:
+            pass
+    export.status = status
 
-def validate_image_data(file_data):
-    """Validate that the data is a valid image"""
+def prune_exports():
+    """Expire exports past EXPORT_RETENTION and artifacts superseded by a newer build"""
+    expire_before = datetime.utcnow().timestamp() - current_app.config['EXPORT_RETENTION']
+    finished = ExportJob.query.filter(ExportJob.status == 'done').order_by(ExportJob.id.desc()).all()
+    latest = set()
+    pruned = 0
+    for export in finished:
+        if export.finished_at.timestamp() < expire_before or export.signature in latest:
+            remove_export_artifact(export)
+            pruned += 1
+        latest.add(export.signature)
+    db.session.commit()
+    return pruned
+
+@job_queue.handler('build_export')
+def build_export_job(export_id):
+    """Write an export archive to EXPORT_FOLDER, recording progress on the export row"""
+    if not claim_export(export_id):
+        return
+    
+    export = db.session.get(ExportJob, export_id)
+    filters = json.loads(export.filters)
+    extension = '.tar.zst' if export.compression == 'zstd' else '.zip'
+    export.processed_entries = 0
+    export.error = None
+    export.fingerprint = export_fingerprint(filters)
+    export.total_entries = int(export.fingerprint.split(':')[0])
+    export.file_name = f"export_{export.id}{extension}"
+    export.download_name = f"{export_basename(filters)}_{export.created_at.strftime('%Y%m%d_%H%M%S')}{extension}"
+    db.session.commit()
+    
+    os.makedirs(current_app.config['EXPORT_FOLDER'], exist_ok=True)
+    path = export_path(export)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
     try:
-        image = Image.open(io.BytesIO(file_data))
-        image.verify()  # Verify it's a valid image
-        return True
+        entries = export_entries(export, filters)
+        if export.compression == 'zstd':
+            chunks = stream_tar_zstd(entries, current_app.config['ARCHIVE_ZSTD_LEVEL'])
+        elif filters['scope'] == 'all':
+            # Label archives are already compressed as requested
+            chunks = stream_zip(entries, zipfile.ZIP_STORED)
+        else:
+            chunks = stream_zip(entries, ARCHIVE_COMPRESSIONS[export.compression])
+        chunks = observe_stream(chunks, archive_build_duration, endpoint=metrics_endpoint(), compression=export.compression)
+        
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
     except Exception as e:
-        logger.warning(f"Invalid image data: {e}")
-        return False
+        db.session.rollback()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        export = db.session.get(ExportJob, export_id)
+        export.status = 'failed'
+        export.active_key = None
+        export.error = str(e)
+        db.session.commit()
+        raise
+    
+    export = db.session.get(ExportJob, export_id)
+    export.status = 'done'
+    export.active_key = None
+    export.size = os.path.getsize(path)
+    export.finished_at = datetime.utcnow()
+    db.session.commit()
+    logger.info("Export %s finished: %s entries, %s bytes", export.id, export.processed_entries, export.size)
+    prune_exports()
+
+# Partitioning and retention
+# On MySQL singora_images is RANGE COLUMNS partitioned by month on date (primary
+# key (id, date)), with a catch-all pfuture partition; see the e3cbb196edc1 migration.
+RETIRED_IMAGES_TABLE = 'singora_images_retired'
+
+def add_months(day, months):
+    """First day of the month `months` after day's month"""
+    month = day.month - 1 + months
+    return day.replace(year=day.year + month // 12, month=month % 12 + 1, day=1)
+
+def images_partitioned():
+    return db.engine.dialect.name == 'mysql' and bool(image_partitions())
+
+def image_partitions():
+    """Partitions of singora_images as (name, exclusive upper bound or None for MAXVALUE, approx rows), oldest first"""
+    if db.engine.dialect.name != 'mysql':
+        return []
+    rows = db.session.execute(db.text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'singora_images' AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    )).all()
+    return [
+        (name, None if bound == 'MAXVALUE' else datetime.strptime(bound.strip("'"), '%Y-%m-%d').date(), table_rows)
+        for name, bound, table_rows in rows
+    ]
+
+def ensure_future_partitions(months_ahead, dry_run=False):
+    """Split monthly partitions off pfuture through months_ahead months past the current one.
+
+    pfuture is normally empty, so REORGANIZE only rewrites metadata. Returns
+    the names of the partitions added (or that would be, with dry_run).
+    """
+    bounds = [bound for _, bound, _ in image_partitions() if bound]
+    if not bounds:
+        raise RuntimeError('singora_images is not partitioned; run `flask db upgrade` against MySQL')
+    
+    month = max(bounds)
+    target = add_months(datetime.utcnow().date(), months_ahead + 1)
+    clauses, added = [], []
+    while month < target:
+        clauses.append(f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{add_months(month, 1).isoformat()}')")
+        added.append(f"p{month:%Y%m}")
+        month = add_months(month, 1)
+    
+    if clauses and not dry_run:
+        db.session.execute(db.text(
+            f"ALTER TABLE singora_images REORGANIZE PARTITION pfuture INTO "
+            f"({', '.join(clauses)}, PARTITION pfuture VALUES LESS THAN (MAXVALUE))"
+        ))
+        logger.info("Added image partitions %s", ', '.join(added))
+    return added
+
+def release_blob_rows(rows):
+    """Set-based release_blob() for many rows; returns hashes whose last reference went"""
+    counts = {}
+    for row in rows:
+        if row.content_hash:
+            counts[row.content_hash] = counts.get(row.content_hash, 0) + 1
+    if not counts:
+        return []
+    
+    blobs = ImageBlob.__table__
+    db.session.execute(
+        blobs.update().where(blobs.c.content_hash == db.bindparam('hash'))
+        .values(ref_count=blobs.c.ref_count - db.bindparam('references')),
+        [{'hash': content_hash, 'references': n} for content_hash, n in counts.items()]
+    )
+    released = [
+        content_hash for (content_hash,) in db.session.query(ImageBlob.content_hash).filter(
+            ImageBlob.content_hash.in_(counts), ImageBlob.ref_count <= 0
+        )
+    ]
+    if released:
+        ImageBlob.query.filter(ImageBlob.content_hash.in_(released)).delete(synchronize_session=False)
+    return released
+
+def drop_released_blobs(released):
+    """Delete bytes and thumbnails of blobs no row references any more (after commit)"""
+    for content_hash in released:
+        discard_blob(content_hash)
+
+def delete_images_before(cutoff, label_name=None, batch_size=5000):
+    """Bulk-delete images dated before cutoff, optionally for one label only.
+
+    Works in batches of ids instead of ORM deletes: each batch writes its
+    tombstones, releases blob references, adjusts label_date_stats and deletes
+    the rows in one transaction. On MySQL the date condition limits every
+    statement to the partitions before cutoff. Returns the number of rows deleted.
+    """
+    conditions = [ImageData.date < cutoff]
+    if label_name is not None:
+        conditions.append(ImageData.label_name == label_name)
+    
+    deleted = 0
+    while True:
+        rows = db.session.query(
+            ImageData.id, ImageData.label_name, ImageData.date, ImageData.content_hash, ImageData.size
+        ).filter(*conditions).order_by(ImageData.date, ImageData.id).limit(batch_size).all()
+        if not rows:
+            break
+        
+        deleted_at = datetime.utcnow()
+        db.session.execute(ImageTombstone.__table__.insert(), [
+            {'image_id': row.id, 'label_name': row.label_name, 'date': row.date,
+             'content_hash': row.content_hash, 'size': row.size, 'deleted_at': deleted_at}
+            for row in rows
+        ])
+        released = release_blob_rows(rows)
+        deltas = {}
+        for row in rows:
+            deltas[(row.label_name, row.date)] = deltas.get((row.label_name, row.date), 0) - 1
+        connection = db.session.connection()
+        for (row_label, row_date), delta in deltas.items():
+            upsert_label_date_stats(connection, row_label, row_date, delta)
+        db.session.execute(ImageData.__table__.delete().where(
+            ImageData.id.in_([row.id for row in rows]), *conditions
+        ))
+        mark_sync_rows(db.session, deleted_image_ids=[row.id for row in rows])
+        db.session.commit()
+        
+        drop_released_blobs(released)
+        deleted += len(rows)
+    
+    if deleted:
+        response_cache.bump()
+    return deleted
+
+def account_retired_images():
+    """Record the rows parked in the retired table as deleted, in one transaction.
+
+    Tombstones, blob references and the stats rollup are updated set-based
+    from the table. Returns (rows, released blob hashes).
+    """
+    retired = RETIRED_IMAGES_TABLE
+    rows = db.session.execute(db.text(f"SELECT COUNT(*) FROM {retired}")).scalar()
+    if not rows:
+        db.session.rollback()
+        return 0, []
+    
+    db.session.execute(db.text(
+        f"INSERT INTO singora_tombstones (image_id, label_name, date, content_hash, size, deleted_at) "
+        f"SELECT id, label_name, date, content_hash, size, :deleted_at FROM {retired}"
+    ), {'deleted_at': datetime.utcnow()})
+    db.session.execute(db.text(
+        f"UPDATE singora_blobs b JOIN (SELECT content_hash, COUNT(*) AS n FROM {retired} "
+        f"WHERE content_hash IS NOT NULL GROUP BY content_hash) r ON r.content_hash = b.content_hash "
+        f"SET b.ref_count = b.ref_count - r.n"
+    ))
+    released = [content_hash for (content_hash,) in db.session.execute(db.text(
+        f"SELECT b.content_hash FROM singora_blobs b JOIN (SELECT DISTINCT content_hash FROM {retired}) r "
+        f"ON r.content_hash = b.content_hash WHERE b.ref_count <= 0"
+    ))]
+    db.session.execute(db.text(
+        f"DELETE b FROM singora_blobs b JOIN (SELECT DISTINCT content_hash FROM {retired}) r "
+        f"ON r.content_hash = b.content_hash WHERE b.ref_count <= 0"
+    ))
+    db.session.execute(db.text(
+        f"UPDATE label_date_stats s JOIN (SELECT label_name, date, COUNT(*) AS n FROM {retired} "
+        f"GROUP BY label_name, date) r ON r.label_name = s.label_name AND r.date = s.date "
+        f"SET s.image_count = s.image_count - r.n"
+    ))
+    db.session.execute(db.text("DELETE FROM label_date_stats WHERE image_count <= 0"))
+    # Last, as in stamp_sync_positions(): the counter stays locked until the commit
+    db.session.execute(db.text(
+        f"UPDATE singora_tombstones t JOIN {retired} r ON t.image_id = r.id "
+        f"SET t.sync_seq = :position WHERE t.sync_seq = 0"
+    ), {'position': next_sync_position(db.session.connection())})
+    db.session.commit()
+    return rows, released
+
+def recover_retired_images():
+    """Finish a retirement interrupted between EXCHANGE PARTITION and dropping the retired table"""
+    exists = db.session.execute(db.text(
+        "SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+    ), {'table': RETIRED_IMAGES_TABLE}).scalar()
+    if not exists:
+        return 0
+    
+    # Tombstones are written in the accounting transaction, so they show whether it committed
+    accounted = db.session.execute(db.text(
+        f"SELECT COUNT(*) FROM singora_tombstones t JOIN (SELECT id, date FROM {RETIRED_IMAGES_TABLE} LIMIT 1) r "
+        f"ON t.image_id = r.id AND t.date = r.date"
+    )).scalar()
+    rows, released = (0, []) if accounted else account_retired_images()
+    db.session.execute(db.text(f"DROP TABLE {RETIRED_IMAGES_TABLE}"))
+    drop_released_blobs(released)
+    return rows
+
+def retire_partition(name):
+    """Remove one monthly partition's rows without deleting them row by row.
+
+    EXCHANGE PARTITION swaps the partition's rows into an empty staging table
+    (a metadata change), the rows are accounted for as deletions, and then the
+    staging table and the now empty partition are dropped. Returns the rows removed.
+    """
+    db.session.execute(db.text(f"CREATE TABLE {RETIRED_IMAGES_TABLE} LIKE singora_images"))
+    db.session.execute(db.text(f"ALTER TABLE {RETIRED_IMAGES_TABLE} REMOVE PARTITIONING"))
+    db.session.execute(db.text(
+        f"ALTER TABLE singora_images EXCHANGE PARTITION {name} WITH TABLE {RETIRED_IMAGES_TABLE}"
+    ))
+    rows, released = account_retired_images()
+    db.session.execute(db.text(f"DROP TABLE {RETIRED_IMAGES_TABLE}"))
+    db.session.execute(db.text(f"ALTER TABLE singora_images DROP PARTITION {name}"))
+    drop_released_blobs(released)
+    logger.info("Dropped image partition %s (%s rows)", name, rows)
+    return rows
+
+def prune_images(retention_months=None, label_days=None, dry_run=False):
+    """Apply the retention policy; returns {'partitions': [...], 'rows': {scope: count}}.
+
+    Months older than retention_months go as whole partitions on partitioned
+    MySQL tables (bulk deletes elsewhere); label_days maps labels to the age
+    in days after which their images are bulk-deleted.
+    """
+    config = current_app.config
+    retention_months = config['RETENTION_MONTHS'] if retention_months is None else retention_months
+    label_days = config['RETENTION_LABEL_DAYS'] if label_days is None else label_days
+    batch_size = config['RETENTION_BATCH_SIZE']
+    today = datetime.utcnow().date()
+    result = {'partitions': [], 'rows': {}}
+    
+    if retention_months:
+        cutoff = add_months(today, -retention_months)
+        if images_partitioned():
+            if not dry_run:
+                result['rows']['recovered'] = recover_retired_images()
+            for name, bound, table_rows in image_partitions():
+                if bound is None or bound > cutoff:
+                    continue
+                result['partitions'].append(name)
+                result['rows'][name] = table_rows if dry_run else retire_partition(name)
+            if result['partitions'] and not dry_run:
+                response_cache.bump()
+        elif dry_run:
+            result['rows']['all'] = ImageData.query.filter(ImageData.date < cutoff).count()
+        else:
+            result['rows']['all'] = delete_images_before(cutoff, batch_size=batch_size)
+    
+    for label_name, days in label_days.items():
+        cutoff = today - timedelta(days=days)
+        if dry_run:
+            result['rows'][label_name] = ImageData.query.filter(
+                ImageData.label_name == label_name, ImageData.date < cutoff
+            ).count()
+        else:
+            result['rows'][label_name] = delete_images_before(cutoff, label_name, batch_size)
+    
+    return result
 
 # Authentication decorator
 def require_api_key(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         api_key = request.headers.get('singora-API-Key')
-        if not api_key or api_key != app.config['API_KEY']:
+        if not api_key or api_key != current_app.config['API_KEY']:
             return jsonify({'error': 'Invalid or missing API key'}), 401
         return f(*args, **kwargs)
     return decorated_function
 
+# Read routing decorator
+def use_replica(f):
+    """Send the view's queries to the read replica (if configured); for routes that never write"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.use_replica = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Request IDs: taken from X-Request-ID when well-formed, echoed back, and stamped on every log record
+@api.before_app_request
+def assign_request_id():
+    request_id = request.headers.get('X-Request-ID', '')
+    g.request_id = request_id if REQUEST_ID_PATTERN.match(request_id) else uuid.uuid4().hex
+
+@api.after_app_request
+def echo_request_id(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+# Request metrics
+@api.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.start()
+
+@api.after_app_request
+def record_request_metrics(response):
+    """Count body bytes and time the request until its (possibly streamed) body is sent"""
+    endpoint = metrics_endpoint()
+    request_bytes = g.get('request_bytes', request.content_length)
+    if request_bytes:
+        http_request_bytes.inc(request_bytes, endpoint=endpoint)
+    
+    if response.is_streamed and response.content_length is None:
+        response.response = count_response_bytes(response.response, endpoint)
+    elif response.content_length:
+        http_response_bytes.inc(response.content_length, endpoint=endpoint)
+    
+    started = g.get('request_started')
+    if started is not None:
+        labels = {'endpoint': endpoint, 'method': request.method, 'status': response.status_code}
+        response.call_on_close(lambda: http_request_duration.observe(time.perf_counter() - started, **labels))
+    return response
+
+def count_response_bytes(chunks, endpoint):
+    """Yield a streamed body through, counting the bytes actually sent"""
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        http_response_bytes.inc(sent, endpoint=endpoint)
+
 # Error handlers
-@app.errorhandler(413)
+@api.app_errorhandler(413)
 def file_too_large(error):
-    return jsonify({'error': 'File too large. Maximum size is 16MB'}), 413
+    return jsonify({'error': 'Request too large'}), 413
 
-@app.errorhandler(400)
+@api.app_errorhandler(400)
 def bad_request(error):
     return jsonify({'error': 'Bad request'}), 400
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
-    logger.error(f"Internal server error: {error}")
+    logger.error("Internal server error: %s", error)
     return jsonify({'error': 'Internal server error'}), 500
 
 # API Routes
-@app.route('/health', methods=['GET'])
+@api.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     try:
@@ -139,18 +3060,22 @@ def health_check():
             'database': 'connected'
         }), 200
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
+        logger.error("Health check failed: %s", e)
         return jsonify({
             'status': 'unhealthy',
             'timestamp': datetime.utcnow().isoformat(),
             'database': 'disconnected'
         }), 503
 
-@app.route('/api/v1/images', methods=['POST'])
+@api.route('/api/v1/images', methods=['POST'])
 @require_api_key
 def upload_image():
     """Upload image with label"""
     try:
+        # Reject oversized bodies before the form is parsed into memory
+        if request.content_length and request.content_length > current_app.config['MAX_IMAGE_SIZE']:
+            return jsonify({'error': 'File too large. Maximum size is 16MB'}), 413
+        
         # Validate request
         if 'image' not in request.files and 'image_data' not in request.form:
             return jsonify({'error': 'No image provided'}), 400
@@ -158,197 +3083,507 @@ def upload_image():
         if 'label_name' not in request.form:
             return jsonify({'error': 'Label name is required'}), 400
         
-        label_name = request.form['label_name'].strip()
-        if not label_name:
-            return jsonify({'error': 'Label name cannot be empty'}), 400
+        label_name = request.form['label_name'].strip()
+        if not label_name:
+            return jsonify({'error': 'Label name cannot be empty'}), 400
+        
+        # Handle file upload (multipart/form-data)
+        if 'image' in request.files:
+            file = request.files['image']
+            if file.filename == '':
+                return jsonify({'error': 'No file selected'}), 400
+            
+            if not allowed_file(file.filename):
+                return jsonify({'error': 'File type not allowed'}), 400
+            
+            file_data, content_hash = read_and_hash(file.stream)
+        
+        # Handle base64 image data
+        elif 'image_data' in request.form:
+            try:
+                file_data = decode_base64_image(request.form['image_data'])
+                content_hash = hashlib.sha256(file_data).hexdigest()
+                    
+            except Exception as e:
+                logger.error("Base64 decode error: %s", e)
+                return jsonify({'error': 'Invalid base64 image data'}), 400
+        
+        # Validate file size
+        if len(file_data) > current_app.config['MAX_IMAGE_SIZE']:
+            return jsonify({'error': 'File too large. Maximum size is 16MB'}), 413
+        
+        # Validate image data
+        image_info = validate_image_data(file_data)
+        if not image_info:
+            return jsonify({'error': 'Invalid image data'}), 400
+        
+        # Store the bytes once per distinct payload; the row keeps only hash and size
+        deduplicated = reference_blob(file_data, content_hash)
+        
+        # Create database record with auto timestamp and date
+        image_record = ImageData(
+            content_hash=content_hash,
+            size=len(file_data),
+            label_name=label_name,
+            **image_info
+            # date and timestamp will be auto-generated
+        )
+        
+        db.session.add(image_record)
+        db.session.flush()
+        enqueue_post_upload_jobs(image_record)
+        db.session.commit()
+        response_cache.bump()
+        
+        logger.info("Image uploaded successfully with ID: %s (deduplicated: %s)", image_record.id, deduplicated)
+        
+        return jsonify({
+            'message': 'Image uploaded successfully',
+            'data': image_record.to_dict(),  # Don't include image data in response
+            'deduplicated': deduplicated
+        }), 201
+        
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Database error: %s", e)
+        return jsonify({'error': 'Database error occurred', "details":str(e)}), 500
+    
+  
+    
+    
+    except Exception as e:
+        logger.error("Upload error: %s", e)
+        return jsonify({'error': 'Upload failed', "details": str(e)}), 500
+
+
+@api.route('/api/v1/images/ingest', methods=['POST'])
+@require_api_key
+def ingest_image():
+    """Upload one image as the raw request body (application/octet-stream or image/*).
+
+    The label comes from the X-Label-Name header or ?label_name=. The body is
+    hashed and sized while it streams into a spooled temp file, then streamed
+    on to the blob store, so it is never held in memory as a whole.
+    """
+    spooled = None
+    try:
+        if request.mimetype != 'application/octet-stream' and not request.mimetype.startswith('image/'):
+            return jsonify({'error': 'Content-Type must be application/octet-stream or image/*'}), 415
+        
+        label_name = (request.headers.get('X-Label-Name') or request.args.get('label_name') or '').strip()
+        if not label_name:
+            return jsonify({'error': 'Label name is required (X-Label-Name header or label_name parameter)'}), 400
+        
+        if request.content_length and request.content_length > current_app.config['MAX_IMAGE_SIZE']:
+            return jsonify({'error': 'File too large. Maximum size is 16MB'}), 413
+        
+        try:
+            spooled, content_hash, size = spool_upload(request.stream, current_app.config['MAX_IMAGE_SIZE'])
+        except ValueError:
+            return jsonify({'error': 'File too large. Maximum size is 16MB'}), 413
+        
+        if not size:
+            return jsonify({'error': 'No image provided'}), 400
+        g.request_bytes = size  # chunked bodies have no Content-Length
+        
+        # Validate image data (fast mode only reads the header)
+        image_info = validate_image_data(spooled)
+        if not image_info:
+            return jsonify({'error': 'Invalid image data'}), 400
+        
+        deduplicated = reference_blob(spooled, content_hash)
+        
+        image_record = ImageData(
+            content_hash=content_hash,
+            size=size,
+            label_name=label_name,
+            **image_info
+        )
+        
+        db.session.add(image_record)
+        db.session.flush()
+        enqueue_post_upload_jobs(image_record)
+        db.session.commit()
+        response_cache.bump()
+        
+        logger.info("Image ingested successfully with ID: %s (deduplicated: %s)", image_record.id, deduplicated)
+        
+        return jsonify({
+            'message': 'Image uploaded successfully',
+            'data': image_record.to_dict(),
+            'deduplicated': deduplicated
+        }), 201
+        
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Database error: %s", e)
+        return jsonify({'error': 'Database error occurred'}), 500
+    
+    except Exception as e:
+        logger.error("Ingest error: %s", e)
+        return jsonify({'error': 'Upload failed'}), 500
+    
+    finally:
+        if spooled is not None:
+            spooled.close()
+
+
+
+def list_images(**path_filters):
+    """Keyset-paginated image listing shared by the GET listing routes.
+
+    Filters come from label_name/date/date_from/date_to query parameters;
+    path_filters (from the route URL) take precedence over them.
+    """
+    cursor, per_page, include_total = keyset_args(20, 100)
+    include_image = request.args.get('include_image', 'false').lower() == 'true'
+    filters = {}
+    
+    query = ImageData.query
+    
+    label_name = path_filters.get('label_name') or request.args.get('label_name')
+    if label_name:
+        query = query.filter(ImageData.label_name == label_name)
+        filters['label_name'] = label_name
+    
+    try:
+        for param in ('date', 'date_from', 'date_to'):
+            value = path_filters.get(param) or request.args.get(param)
+            if not value:
+                continue
+            filter_date = datetime.strptime(value, '%Y-%m-%d').date()
+            if param == 'date':
+                query = query.filter(ImageData.date == filter_date)
+            elif param == 'date_from':
+                query = query.filter(ImageData.date >= filter_date)
+            else:
+                query = query.filter(ImageData.date <= filter_date)
+            filters[param] = value
+    except ValueError:
+        return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+    
+    try:
+        since = since_arg()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if since is not None:
+        query = query.filter(since_condition(since))
+        filters['since'] = request.args['since']
+    
+    try:
+        images, pagination = paginate_keyset(query, cursor, per_page, include_total)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'data': [image.to_dict(include_image=include_image) for image in images],
+        'pagination': pagination,
+        'filters': filters
+    }), 200
+
+@api.route('/api/v1/images', methods=['GET'])
+@require_api_key
+@use_replica
+def get_images():
+    """Get images with optional filtering (paginated with ?cursor=)"""
+    try:
+        return list_images()
+    except Exception as e:
+        logger.error("Get images error: %s", e)
+        return jsonify({'error': 'Failed to retrieve images'}), 500
+
+@api.route('/api/v1/images/by-label/<label_name>', methods=['GET'])
+@require_api_key
+@use_replica
+def get_images_by_label(label_name):
+    """Get images with an exact label (paginated with ?cursor=)"""
+    try:
+        return list_images(label_name=label_name)
+    except Exception as e:
+        logger.error("Get images by label error: %s", e)
+        return jsonify({'error': 'Failed to retrieve images'}), 500
+
+@api.route('/api/v1/images/by-date/<date>', methods=['GET'])
+@require_api_key
+@use_replica
+def get_images_by_date(date):
+    """Get images for a specific date (paginated with ?cursor=)"""
+    try:
+        return list_images(date=date)
+    except Exception as e:
+        logger.error("Get images by date error: %s", e)
+        return jsonify({'error': 'Failed to retrieve images'}), 500
+
+@api.route('/api/v1/images/manifest', methods=['GET'])
+@require_api_key
+@use_replica
+def get_image_manifest():
+    """Images added and deleted since a sync cursor (ids, hashes and sizes only)"""
+    try:
+        limit = max(1, min(request.args.get('limit', 1000, type=int), 10000))
+        cursor = request.args.get('cursor')
+        try:
+            image_watermark, tombstone_watermark = decode_sync_cursor(cursor) if cursor else ((0, 0), (0, 0))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Positions are handed out at commit, so rows still in flight can only appear after the cursor
+        added_query = db.session.query(
+            ImageData.id, ImageData.label_name, ImageData.date, ImageData.timestamp,
+            ImageData.content_hash, ImageData.size, ImageData.sync_seq
+        ).filter(sync_position_after(ImageData, image_watermark))
+        deleted_query = ImageTombstone.query.filter(sync_position_after(ImageTombstone, tombstone_watermark))
+        
+        filters = {}
+        label_name = request.args.get('label_name')
+        if label_name:
+            added_query = added_query.filter(ImageData.label_name == label_name)
+            deleted_query = deleted_query.filter(ImageTombstone.label_name == label_name)
+            filters['label_name'] = label_name
+        
+        try:
+            for param in ('date_from', 'date_to'):
+                value = request.args.get(param)
+                if not value:
+                    continue
+                filter_date = datetime.strptime(value, '%Y-%m-%d').date()
+                if param == 'date_from':
+                    added_query = added_query.filter(ImageData.date >= filter_date)
+                    deleted_query = deleted_query.filter(ImageTombstone.date >= filter_date)
+                else:
+                    added_query = added_query.filter(ImageData.date <= filter_date)
+                    deleted_query = deleted_query.filter(ImageTombstone.date <= filter_date)
+                filters[param] = value
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+        
+        # Ascending positions, so the last row of each page is the new watermark
+        added = added_query.order_by(ImageData.sync_seq, ImageData.id).limit(limit).all()
+        deleted = deleted_query.order_by(ImageTombstone.sync_seq, ImageTombstone.id).limit(limit).all()
+        
+        if added:
+            image_watermark = (added[-1].sync_seq, added[-1].id)
+        if deleted:
+            tombstone_watermark = (deleted[-1].sync_seq, deleted[-1].id)
+        
+        return jsonify({
+            'added': [
+                {
+                    'id': row.id,
+                    'label_name': row.label_name,
+                    'date': row.date.isoformat() if row.date else None,
+                    'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+                    'content_hash': row.content_hash,
+                    'size': row.size
+                }
+                for row in added
+            ],
+            'deleted': [tombstone.to_dict() for tombstone in deleted],
+            'cursor': encode_sync_cursor(image_watermark, tombstone_watermark),
+            'has_more': len(added) == limit or len(deleted) == limit,
+            'filters': filters
+        }), 200
+        
+    except Exception as e:
+        logger.error("Get image manifest error: %s", e)
+        return jsonify({'error': 'Failed to build manifest'}), 500
+
+@api.route('/api/v1/images/batch', methods=['POST'])
+@require_api_key
+def upload_images_batch():
+    """Upload many images in one request, stored in a single transaction.
+
+    Accepts multipart/form-data with repeated 'images' files and a shared
+    'label_name', or an application/x-ndjson body with one
+    {"label_name": ..., "image_data": <base64>} record per line.
+    Invalid items are reported individually and do not abort the batch.
+    """
+    try:
+        items = []
         
-        # Handle file upload (multipart/form-data)
-        if 'image' in request.files:
-            file = request.files['image']
-            if file.filename == '':
-                return jsonify({'error': 'No file selected'}), 400
+        if request.mimetype == 'application/x-ndjson':
+            for line in iter(request.stream.readline, b''):
+                if len(items) > current_app.config['MAX_BATCH_SIZE']:
+                    break
+                if not line.strip():
+                    continue
+                item = {'index': len(items)}
+                items.append(item)
+                try:
+                    record = json.loads(line)
+                    item['label_name'] = str(record.get('label_name') or '').strip()
+                    item['data'] = decode_base64_image(record['image_data'])
+                except Exception:
+                    item['error'] = 'Invalid record: expected label_name and base64 image_data'
+                    continue
+                if not item['label_name']:
+                    item['error'] = 'Label name is required'
+        else:
+            files = request.files.getlist('images')
+            if not files:
+                return jsonify({'error': 'No images provided'}), 400
             
-            if not allowed_file(file.filename):
-                return jsonify({'error': 'File type not allowed'}), 400
+            label_name = request.form.get('label_name', '').strip()
+            if not label_name:
+                return jsonify({'error': 'Label name is required'}), 400
             
-            file_data = file.read()
+            for index, file in enumerate(files):
+                item = {'index': index, 'filename': file.filename, 'label_name': label_name}
+                items.append(item)
+                if file.filename == '' or not allowed_file(file.filename):
+                    item['error'] = 'File type not allowed'
+                    continue
+                item['data'], item['content_hash'] = read_and_hash(file.stream)
         
-        # Handle base64 image data
-        elif 'image_data' in request.form:
-            try:
-                image_data = request.form['image_data']
-                # Remove data URL prefix if present
-                if image_data.startswith('data:image'):
-                    image_data = image_data.split(',', 1)[1]
-                
-                file_data = base64.b64decode(image_data)
-                    
-            except Exception as e:
-                logger.error(f"Base64 decode error: {e}")
-                return jsonify({'error': 'Invalid base64 image data'}), 400
+        if not items:
+            return jsonify({'error': 'No images provided'}), 400
         
-        # Validate file size
-        if len(file_data) > app.config['MAX_CONTENT_LENGTH']:
-            return jsonify({'error': 'File too large'}), 413
+        if len(items) > current_app.config['MAX_BATCH_SIZE']:
+            return jsonify({'error': f"Batch too large. Maximum is {current_app.config['MAX_BATCH_SIZE']} images"}), 413
         
-        # Validate image data
-        if not validate_image_data(file_data):
-            return jsonify({'error': 'Invalid image data'}), 400
+        for item in items:
+            if 'error' not in item and len(item['data']) > current_app.config['MAX_IMAGE_SIZE']:
+                item['error'] = 'File too large. Maximum size is 16MB'
         
-        # Create database record with auto timestamp and date
-        image_record = ImageData(
-            image=file_data,  # Store binary data directly
-            label_name=label_name
-            # date and timestamp will be auto-generated
-        )
+        # Validate all remaining images in parallel
+        pending = [item for item in items if 'error' not in item]
+        for item, image_info in zip(pending, get_validation_pool().map(with_app_context(validate_image_data), [item['data'] for item in pending])):
+            if image_info:
+                item['image_info'] = image_info
+            else:
+                item['error'] = 'Invalid image data'
         
-        db.session.add(image_record)
-        db.session.commit()
+        valid_items = [item for item in items if 'error' not in item]
+        if valid_items:
+            for item in valid_items:
+                if 'content_hash' not in item:
+                    item['content_hash'] = hashlib.sha256(item['data']).hexdigest()
+            
+            dedup_flags = reference_blobs([(item['content_hash'], item['data']) for item in valid_items])
+            # Per-item results need the generated IDs, which MySQL only reports
+            # per INSERT (no RETURNING), so rows are flushed as ORM objects
+            records = [
+                ImageData(content_hash=item['content_hash'], size=len(item['data']), label_name=item['label_name'],
+                          **item['image_info'])
+                for item in valid_items
+            ]
+            db.session.add_all(records)
+            db.session.flush()
+            for record in records:
+                enqueue_post_upload_jobs(record)
+            db.session.commit()
+            response_cache.bump()
+            
+            for item, record, deduplicated in zip(valid_items, records, dedup_flags):
+                item['id'] = record.id
+                item['deduplicated'] = deduplicated
+        
+        results = []
+        for item in items:
+            result = {'index': item['index'], 'label_name': item.get('label_name')}
+            if 'filename' in item:
+                result['filename'] = item['filename']
+            if 'error' in item:
+                result.update({'status': 'failed', 'error': item['error']})
+            else:
+                result.update({'status': 'created', 'id': item['id'], 'deduplicated': item['deduplicated']})
+            results.append(result)
         
-        logger.info(f"Image uploaded successfully with ID: {image_record.id}")
+        logger.info("Batch upload stored %s of %s images", len(valid_items), len(items))
         
         return jsonify({
-            'message': 'Image uploaded successfully',
-            'data': image_record.to_dict()  # Don't include image data in response
-        }), 201
+            'message': f'Stored {len(valid_items)} of {len(items)} images',
+            'created': len(valid_items),
+            'failed': len(items) - len(valid_items),
+            'results': results
+        }), 201 if valid_items else 400
         
     except SQLAlchemyError as e:
         db.session.rollback()
-        logger.error(f"Database error: {e}")
-        return jsonify({'error': 'Database error occurred', "details":str(e)}), 500
-    
-  
-    
+        logger.error("Database error during batch upload: %s", e)
+        return jsonify({'error': 'Database error occurred', "details": str(e)}), 500
     
     except Exception as e:
-        logger.error(f"Upload error: {e}")
-        return jsonify({'error': 'Upload failed', "details": str(e)}), 500
+        logger.error("Batch upload error: %s", e)
+        return jsonify({'error': 'Batch upload failed', "details": str(e)}), 500
 
 
 
 
-@app.route('/api/v1/images/download/all', methods=['GET'])
+@api.route('/api/v1/images/download/all', methods=['GET'])
 @require_api_key
+@use_replica
 def download_all_images():
     """Download all images organized by label_name in separate ZIP files within a main ZIP"""
     try:
-        # Create a temporary directory to store individual label ZIP files
-        temp_dir = tempfile.mkdtemp()
-        main_zip_path = os.path.join(temp_dir, 'all_images_by_labels.zip')
+        try:
+            compression = archive_compression_arg()
+            since = since_arg()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Get all unique label names
-        labels = db.session.query(ImageData.label_name).distinct().all()
+        # Get all unique label names (with images added after since, if given)
+        labels_query = db.session.query(ImageData.label_name).distinct()
+        if since is not None:
+            labels_query = labels_query.filter(since_condition(since))
+        labels = labels_query.all()
         
         if not labels:
             return jsonify({'error': 'No images found'}), 404
         
-        with zipfile.ZipFile(main_zip_path, 'w', zipfile.ZIP_DEFLATED) as main_zip:
-            for (label_name,) in labels:
-                # Get all images for this label
-                images = ImageData.query.filter(ImageData.label_name == label_name).all()
-                
-                if images:
-                    # Create ZIP content for this label in memory
-                    label_zip_buffer = io.BytesIO()
-                    
-                    with zipfile.ZipFile(label_zip_buffer, 'w', zipfile.ZIP_DEFLATED) as label_zip:
-                        for image in images:
-                            if image.image:
-                                # Create filename with timestamp for uniqueness
-                                timestamp_str = image.timestamp.strftime('%Y%m%d_%H%M%S')
-                                filename = f"{timestamp_str}_{image.id}.jpg"
-                                
-                                # Add image to label ZIP
-                                label_zip.writestr(filename, image.image)
-                    
-                    # Add the label ZIP to main ZIP
-                    label_zip_buffer.seek(0)
-                    main_zip.writestr(f"{label_name}.zip", label_zip_buffer.read())
-                    label_zip_buffer.close()
+        # Deflate is applied inside the label archives; zstd wraps the outer tar
+        inner_compression = zipfile.ZIP_DEFLATED if compression == 'deflate' else zipfile.ZIP_STORED
         
-        # Send the main ZIP file
-        return send_file(
-            main_zip_path,
-            as_attachment=True,
-            download_name=f"all_images_by_labels_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-            mimetype='application/zip'
+        def label_archives():
+            # Per-label archives are built concurrently and added as each finishes
+            label_names = [label for (label,) in labels]
+            for label_name, archive in build_label_archives_parallel(label_names, inner_compression, since):
+                yield f"{label_name}.zip", archive
+        
+        # The outer archive only holds label ZIPs, so never deflate them twice
+        return archive_response(
+            label_archives(),
+            f"all_images_by_labels_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+            'zstd' if compression == 'zstd' else 'stored'
         )
         
     except Exception as e:
-        logger.error(f"Download all images error: {e}")
-        # Clean up temp directory if it exists
-        if 'temp_dir' in locals() and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
+        logger.error("Download all images error: %s", e)
         return jsonify({'error': 'Failed to create download'}), 500
 
 
 
-@app.route('/api/v1/images/download/label/<label_name>', methods=['GET'])
+@api.route('/api/v1/images/download/label/<label_name>', methods=['GET'])
 @require_api_key
+@use_replica
 def download_images_by_label(label_name):
     """Download all images for a specific label as a ZIP file"""
     try:
-        # Build query
-        query = ImageData.query.filter(ImageData.label_name == label_name)
+        try:
+            compression = archive_compression_arg()
+            since = since_arg()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Get all images for the label
-        images = query.order_by(ImageData.timestamp.desc()).all()
+        # Stream images for the label, newest first
+        conditions, order_by, entry_name = archive_scope('label', label_name=label_name, since=since)
+        images = peek_rows(iter_bulk(ImageData.query.filter(*conditions), order_by))
         
         if not images:
             return jsonify({'error': f'No images found for label: {label_name}'}), 404
         
-        # Create temporary file for ZIP
-        temp_fd, temp_path = tempfile.mkstemp(suffix='.zip')
+        # Generate download filename
+        download_basename = f"{label_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         
-        try:
-            with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for image in images:
-                    if image.image and len(image.image) > 0:
-                        # Create filename with timestamp and date for better organization
-                        timestamp_str = image.timestamp.strftime('%Y%m%d_%H%M%S')
-                        filename = f"{timestamp_str}_{image.id}.jpg"
-                        
-                        # Add image to ZIP
-                        zip_file.writestr(filename, image.image)
-            
-            # Generate download filename
-            download_filename = f"{label_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-            
-            # Return file and schedule cleanup
-            def remove_file(response):
-                try:
-                    os.close(temp_fd)
-                    os.unlink(temp_path)
-                except Exception:
-                    pass
-                return response
-            
-            response = send_file(
-                temp_path,
-                as_attachment=True,
-                download_name=download_filename,
-                mimetype='application/zip'
-            )
-            
-            # Clean up temp file after response
-            response.call_on_close(lambda: remove_file(response))
-            return response
-            
-        except Exception as e:
-            # Clean up temp file on error
-            try:
-                os.close(temp_fd)
-                os.unlink(temp_path)
-            except Exception:
-                pass
-            raise e
+        return archive_response(image_entries(images, entry_name), download_basename, compression)
         
     except Exception as e:
-        logger.error(f"Download images by label error: {e}")
+        logger.error("Download images by label error: %s", e)
         return jsonify({'error': 'Failed to create download'}), 500
 
-@app.route('/api/v1/images/download/date/<date>', methods=['GET'])
+@api.route('/api/v1/images/download/date/<date>', methods=['GET'])
 @require_api_key
+@use_replica
 def download_images_by_date(date):
     """Download all images for a specific date, organized by label folders within ZIP"""
     try:
@@ -358,71 +3593,35 @@ def download_images_by_date(date):
         except ValueError:
             return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
         
+        try:
+            compression = archive_compression_arg()
+            since = since_arg()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # Optional label filtering
         label_name = request.args.get('label_name')
         
-        # Build query
-        query = ImageData.query.filter(ImageData.date == filter_date)
-        
-        if label_name:
-            query = query.filter(ImageData.label_name == label_name)
-        
-        # Get all images for the date
-        images = query.order_by(ImageData.label_name, ImageData.timestamp).all()
+        # Stream images for the date, in label folders
+        conditions, order_by, entry_name = archive_scope('date', label_name=label_name, date=filter_date, since=since)
+        images = peek_rows(iter_bulk(ImageData.query.filter(*conditions), order_by))
         
         if not images:
             return jsonify({'error': f'No images found for date: {date}'}), 404
         
-        # Create temporary file for ZIP
-        temp_fd, temp_path = tempfile.mkstemp(suffix='.zip')
+        # Generate download filename
+        label_suffix = f"_{label_name}" if label_name else ""
+        download_basename = f"images_{date}{label_suffix}_{datetime.now().strftime('%H%M%S')}"
         
-        try:
-            with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for image in images:
-                    if image.image and len(image.image) > 0:
-                        # Create folder structure: label_name/filename
-                        timestamp_str = image.timestamp.strftime('%H%M%S')  # Just time for same date
-                        filename = f"{image.label_name}/{timestamp_str}_{image.id}.jpg"
-                        
-                        # Add image to ZIP with folder structure
-                        zip_file.writestr(filename, image.image)
-            
-            # Generate download filename
-            label_suffix = f"_{label_name}" if label_name else ""
-            download_filename = f"images_{date}{label_suffix}_{datetime.now().strftime('%H%M%S')}.zip"
-            
-            def remove_file(response):
-                try:
-                    os.close(temp_fd)
-                    os.unlink(temp_path)
-                except Exception:
-                    pass
-                return response
-            
-            response = send_file(
-                temp_path,
-                as_attachment=True,
-                download_name=download_filename,
-                mimetype='application/zip'
-            )
-            
-            response.call_on_close(lambda: remove_file(response))
-            return response
-            
-        except Exception as e:
-            try:
-                os.close(temp_fd)
-                os.unlink(temp_path)
-            except Exception:
-                pass
-            raise e
+        return archive_response(image_entries(images, entry_name), download_basename, compression)
             
     except Exception as e:
-        logger.error(f"Download images by date error: {e}")
+        logger.error("Download images by date error: %s", e)
         return jsonify({'error': 'Failed to create download'}), 500
 
-@app.route('/api/v1/images/download/label/<label_name>/date/<date>', methods=['GET'])
+@api.route('/api/v1/images/download/label/<label_name>/date/<date>', methods=['GET'])
 @require_api_key
+@use_replica
 def download_images_by_label_and_date(label_name, date):
     """Download images filtered by both label_name and specific date"""
     try:
@@ -433,36 +3632,39 @@ def download_images_by_label_and_date(label_name, date):
             return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
         
         # Query parameters for additional filtering
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 1000, type=int), 1000)
+        cursor, per_page, include_total = keyset_args(1000, 1000)
         download_format = request.args.get('format', 'zip').lower()
+        try:
+            thumbnail_size = thumbnail_size_arg()
+            since = since_arg()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Build query with both label and date filters
         query = ImageData.query.filter(
             ImageData.label_name == label_name,
             ImageData.date == filter_date
         )
+        if since is not None:
+            query = query.filter(since_condition(since))
         
         # Get images (with pagination support for very large datasets)
-        if download_format == 'json':
-            # For JSON response, use pagination
-            paginated_images = query.order_by(ImageData.timestamp.desc()).paginate(
-                page=page, per_page=per_page, error_out=False
-            )
-            images = paginated_images.items
+        if download_format == 'ndjson':
+            # Every matching image, one record per line, streamed as rows are fetched
+            return ndjson_response(iter_bulk(query, [ImageData.timestamp.desc()]), thumbnail_size)
+        
+        elif download_format == 'json':
+            # For JSON response, use keyset pagination
+            try:
+                images, pagination = paginate_keyset(query, cursor, per_page, include_total)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             
             if not images:
                 return jsonify({
                     'message': f'No images found for label "{label_name}" on date {date}',
                     'data': [],
-                    'pagination': {
-                        'page': page,
-                        'per_page': per_page,
-                        'total': 0,
-                        'pages': 0,
-                        'has_next': False,
-                        'has_prev': False
-                    },
+                    'pagination': pagination,
                     'filters': {
                         'label_name': label_name,
                         'date': date
@@ -471,15 +3673,11 @@ def download_images_by_label_and_date(label_name, date):
             
             # Return JSON response with image data
             return jsonify({
-                'data': [image.to_dict(include_image=True) for image in images],
-                'pagination': {
-                    'page': page,
-                    'per_page': per_page,
-                    'total': paginated_images.total,
-                    'pages': paginated_images.pages,
-                    'has_next': paginated_images.has_next,
-                    'has_prev': paginated_images.has_prev
-                },
+                'data': [
+                    image.to_dict(include_image=not thumbnail_size, thumbnail_size=thumbnail_size)
+                    for image in images
+                ],
+                'pagination': pagination,
                 'filters': {
                     'label_name': label_name,
                     'date': date
@@ -488,63 +3686,32 @@ def download_images_by_label_and_date(label_name, date):
             }), 200
         
         else:  # ZIP download
-            # Get all images for ZIP download
-            images = query.order_by(ImageData.timestamp.desc()).all()
+            try:
+                compression = archive_compression_arg()
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            # Stream all images for ZIP download
+            conditions, order_by, entry_name = archive_scope('label_date', label_name=label_name, date=filter_date, since=since)
+            images = peek_rows(iter_bulk(ImageData.query.filter(*conditions), order_by))
             
             if not images:
                 return jsonify({
                     'error': f'No images found for label "{label_name}" on date {date}'
                 }), 404
             
-            # Create temporary file for ZIP
-            temp_fd, temp_path = tempfile.mkstemp(suffix='.zip')
+            # Generate download filename
+            download_basename = f"{label_name}_{date}_{datetime.now().strftime('%H%M%S')}"
             
-            try:
-                with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    for image in images:
-                        if image.image and len(image.image) > 0:
-                            # Create filename with time (since date is already specified)
-                            time_str = image.timestamp.strftime('%H%M%S')
-                            filename = f"{time_str}_{image.id}.jpg"
-                            
-                            # Add image to ZIP
-                            zip_file.writestr(filename, image.image)
-                
-                # Generate download filename
-                download_filename = f"{label_name}_{date}_{datetime.now().strftime('%H%M%S')}.zip"
-                
-                def remove_file(response):
-                    try:
-                        os.close(temp_fd)
-                        os.unlink(temp_path)
-                    except Exception:
-                        pass
-                    return response
-                
-                response = send_file(
-                    temp_path,
-                    as_attachment=True,
-                    download_name=download_filename,
-                    mimetype='application/zip'
-                )
-                
-                response.call_on_close(lambda: remove_file(response))
-                return response
-                
-            except Exception as e:
-                try:
-                    os.close(temp_fd)
-                    os.unlink(temp_path)
-                except Exception:
-                    pass
-                raise e
+            return archive_response(image_entries(images, entry_name), download_basename, compression)
         
     except Exception as e:
-        logger.error(f"Download images by label and date error: {e}")
+        logger.error("Download images by label and date error: %s", e)
         return jsonify({'error': 'Failed to retrieve/download images'}), 500
 
-@app.route('/api/v1/images/download/label/<label_name>/date-range', methods=['GET'])
+@api.route('/api/v1/images/download/label/<label_name>/date-range', methods=['GET'])
 @require_api_key
+@use_replica
 def download_images_by_label_and_date_range(label_name):
     """Download images filtered by label_name and date range"""
     try:
@@ -571,6 +3738,11 @@ def download_images_by_label_and_date_range(label_name):
         # Optional parameters
         download_format = request.args.get('format', 'zip').lower()
         organize_by_date = request.args.get('organize_by_date', 'true').lower() == 'true'
+        try:
+            thumbnail_size = thumbnail_size_arg()
+            since = since_arg()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Build query
         query = ImageData.query.filter(
@@ -578,23 +3750,62 @@ def download_images_by_label_and_date_range(label_name):
             ImageData.date >= from_date,
             ImageData.date <= to_date
         )
+        if since is not None:
+            query = query.filter(since_condition(since))
+        
+        def group_by_date(images):
+            images_by_date = {}
+            for image in images:
+                date_key = image.date.isoformat()
+                if date_key not in images_by_date:
+                    images_by_date[date_key] = []
+                images_by_date[date_key].append(
+                    image.to_dict(include_image=not thumbnail_size, thumbnail_size=thumbnail_size)
+                )
+            return images_by_date
+        
+        # Opt-in keyset pagination for the JSON response (?per_page= or ?cursor=)
+        if download_format == 'json' and ('per_page' in request.args or 'cursor' in request.args):
+            cursor, per_page, include_total = keyset_args(100, 1000)
+            try:
+                images, pagination = paginate_keyset(query, cursor, per_page, include_total)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            images_by_date = group_by_date(images)
+            return jsonify({
+                'label_name': label_name,
+                'date_range': {
+                    'from': date_from,
+                    'to': date_to
+                },
+                'images_in_page': len(images),
+                'dates_with_images': len(images_by_date),
+                'data': images_by_date,
+                'pagination': pagination
+            }), 200
+        
+        if download_format not in ('json', 'ndjson'):
+            try:
+                compression = archive_compression_arg()
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
-        # Get images
-        images = query.order_by(ImageData.date, ImageData.timestamp).all()
+        # Stream images
+        images = peek_rows(iter_bulk(query, [ImageData.date, ImageData.timestamp]))
         
         if not images:
             return jsonify({
                 'error': f'No images found for label "{label_name}" between {date_from} and {date_to}'
             }), 404
         
+        if download_format == 'ndjson':
+            # One record per line in date order, streamed instead of grouped in memory
+            return ndjson_response(images, thumbnail_size)
+        
         if download_format == 'json':
             # Group by date for JSON response
-            images_by_date = {}
-            for image in images:
-                date_key = image.date.isoformat()
-                if date_key not in images_by_date:
-                    images_by_date[date_key] = []
-                images_by_date[date_key].append(image.to_dict(include_image=True))
+            images_by_date = group_by_date(images)
             
             return jsonify({
                 'label_name': label_name,
@@ -602,81 +3813,44 @@ def download_images_by_label_and_date_range(label_name):
                     'from': date_from,
                     'to': date_to
                 },
-                'total_images': len(images),
+                'total_images': sum(len(day) for day in images_by_date.values()),
                 'dates_with_images': len(images_by_date),
                 'data': images_by_date,
                 'download_url': f'/api/v1/images/download/label/{label_name}/date-range?date_from={date_from}&date_to={date_to}&format=zip'
             }), 200
         
         else:  # ZIP download
-            # Create temporary file for ZIP
-            temp_fd, temp_path = tempfile.mkstemp(suffix='.zip')
+            entry_name = archive_scope(
+                'date_range', label_name=label_name, date_from=from_date, date_to=to_date,
+                organize_by_date=organize_by_date
+            )[2]
             
-            try:
-                with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    for image in images:
-                        if image.image and len(image.image) > 0:
-                            if organize_by_date:
-                                # Organize in date folders: 2024-01-15/143022_123.jpg
-                                date_folder = image.date.isoformat()
-                                time_str = image.timestamp.strftime('%H%M%S')
-                                filename = f"{date_folder}/{time_str}_{image.id}.jpg"
-                            else:
-                                # Flat structure with date in filename: 20240115_143022_123.jpg
-                                datetime_str = image.timestamp.strftime('%Y%m%d_%H%M%S')
-                                filename = f"{datetime_str}_{image.id}.jpg"
-                            
-                            zip_file.writestr(filename, image.image)
-                
-                # Generate download filename
-                download_filename = f"{label_name}_{date_from}_to_{date_to}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-                
-                def remove_file(response):
-                    try:
-                        os.close(temp_fd)
-                        os.unlink(temp_path)
-                    except Exception:
-                        pass
-                    return response
-                
-                response = send_file(
-                    temp_path,
-                    as_attachment=True,
-                    download_name=download_filename,
-                    mimetype='application/zip'
-                )
-                
-                response.call_on_close(lambda: remove_file(response))
-                return response
-                
-            except Exception as e:
-                try:
-                    os.close(temp_fd)
-                    os.unlink(temp_path)
-                except Exception:
-                    pass
-                raise e
+            # Generate download filename
+            download_basename = f"{label_name}_{date_from}_to_{date_to}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            
+            return archive_response(image_entries(images, entry_name), download_basename, compression)
         
     except Exception as e:
-        logger.error(f"Download images by label and date range error: {e}")
+        logger.error("Download images by label and date range error: %s", e)
         return jsonify({'error': 'Failed to retrieve/download images'}), 500
 
 
-@app.route('/api/v1/images/download/info', methods=['GET'])
+@api.route('/api/v1/images/download/info', methods=['GET'])
 @require_api_key
+@response_cache.cached
 def get_download_info():
     """Get information about available downloads (labels and counts)"""
     try:
-        # Get label statistics
+        # Get label statistics from the label/date rollup
         label_stats = db.session.query(
-            ImageData.label_name,
-            db.func.count(ImageData.id).label('count'),
-            db.func.min(ImageData.date).label('earliest_date'),
-            db.func.max(ImageData.date).label('latest_date')
-        ).group_by(ImageData.label_name).all()
+            LabelDateStats.label_name,
+            db.func.sum(LabelDateStats.image_count).label('count'),
+            db.func.min(LabelDateStats.date).label('earliest_date'),
+            db.func.max(LabelDateStats.date).label('latest_date')
+        ).group_by(LabelDateStats.label_name).all()
         
         # Get total statistics
-        total_images = ImageData.query.count()
+        total_images = sum(int(stat.count) for stat in label_stats)
         total_labels = len(label_stats)
         
         return jsonify({
@@ -685,7 +3859,7 @@ def get_download_info():
             'labels': [
                 {
                     'label_name': stat.label_name,
-                    'image_count': stat.count,
+                    'image_count': int(stat.count),
                     'earliest_date': stat.earliest_date.isoformat() if stat.earliest_date else None,
                     'latest_date': stat.latest_date.isoformat() if stat.latest_date else None
                 }
@@ -702,30 +3876,120 @@ def get_download_info():
         }), 200
         
     except Exception as e:
-        logger.error(f"Get download info error: {e}")
+        logger.error("Get download info error: %s", e)
         return jsonify({'error': 'Failed to retrieve download information'}), 500
 
 
 
-#     """Download image as binary data"""
-#     try:
-#         image = ImageData.query.get(image_id)
+# Content types for stored image formats: (mimetype, file extension)
+IMAGE_CONTENT_TYPES = {
+    'PNG': ('image/png', 'png'),
+    'JPEG': ('image/jpeg', 'jpg'),
+    'GIF': ('image/gif', 'gif'),
+    'WEBP': ('image/webp', 'webp'),
+    'BMP': ('image/bmp', 'bmp')
+}
+
+def send_image(image, as_attachment=False):
+    """Send one image's bytes with a strong content-hash ETag, Range support and long-lived caching"""
+    content_hash = image.content_hash or hashlib.sha256(image.get_image_bytes()).hexdigest()
+    mimetype, extension = IMAGE_CONTENT_TYPES.get(image.image_format, ('application/octet-stream', 'jpg'))
+    
+    # Revalidations are answered without touching the blob store
+    if request.if_none_match.contains(content_hash):
+        response = Response(status=304)
+        response.set_etag(content_hash)
+    else:
+        blob_path = get_blob_store().local_path(content_hash) if image.content_hash else None
+        response = send_file(
+            blob_path if blob_path else io.BytesIO(image.get_image_bytes()),
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=f"image_{image.id}.{extension}",
+            etag=content_hash,
+            last_modified=image.timestamp,
+            max_age=31536000,
+            conditional=True  # Handles If-None-Match, If-Modified-Since and Range
+        )
+    
+    # Image bytes never change for a given hash
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response
+
+@api.route('/api/v1/images/<int:image_id>/raw', methods=['GET'])
+@require_api_key
+def get_image_raw(image_id):
+    """Get an image's raw bytes (supports ETag/If-None-Match and Range)"""
+    try:
+        image = ImageData.query.get(image_id)
+        
+        if not image:
+            return jsonify({'error': 'Image not found'}), 404
+        
+        return send_image(image)
+        
+    except Exception as e:
+        logger.error("Get raw image error: %s", e)
+        return jsonify({'error': 'Failed to retrieve image'}), 500
+
+@api.route('/api/v1/images/<int:image_id>/download', methods=['GET'])
+@require_api_key
+def download_image(image_id):
+    """Download image as binary data"""
+    try:
+        image = ImageData.query.get(image_id)
+        
+        if not image:
+            return jsonify({'error': 'Image not found'}), 404
+        
+        return send_image(image, as_attachment=True)
+        
+    except Exception as e:
+        logger.error("Download image error: %s", e)
+        return jsonify({'error': 'Failed to download image'}), 500
+
+@api.route('/api/v1/images/<int:image_id>/thumbnail', methods=['GET'])
+@require_api_key
+def get_image_thumbnail(image_id):
+    """Get a resized preview of an image (?size=256&format=webp)"""
+    try:
+        size = request.args.get('size', 256, type=int)
+        thumbnail_format = request.args.get('format', 'webp').lower()
+        
+        if size not in current_app.config['THUMBNAIL_SIZES']:
+            return jsonify({'error': f"Unsupported size. Use one of {sorted(current_app.config['THUMBNAIL_SIZES'])}"}), 400
+        
+        if thumbnail_format not in THUMBNAIL_FORMATS:
+            return jsonify({'error': f"Unsupported format. Use one of {sorted(THUMBNAIL_FORMATS)}"}), 400
+        
+        image = ImageData.query.get(image_id)
+        
+        if not image:
+            return jsonify({'error': 'Image not found'}), 404
         
-#         if not image:
-#             return jsonify({'error': 'Image not found'}), 404
+        content_hash = image.content_hash or hashlib.sha256(image.get_image_bytes()).hexdigest()
+        etag = f"{content_hash}-{size}-{thumbnail_format}"
         
-#         # Return image as binary response
-#         return app.response_class(
-#             image.image,
-#             mimetype='image/jpeg',  # You might want to store and use actual mime type
-#             headers={'Content-Disposition': f'attachment; filename=image_{image_id}.jpg'}
-#         )
+        # Answer revalidations without loading or rendering anything
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            data = get_thumbnail_cache().get(content_hash, size, thumbnail_format, image.get_image_bytes)
+            response = Response(data, mimetype=THUMBNAIL_FORMATS[thumbnail_format][1])
         
-#     except Exception as e:
-#         logger.error(f"Download image error: {e}")
-#         return jsonify({'error': 'Failed to download image'}), 500
+        # Thumbnails are derived from immutable content, so they can be cached for long
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        return response
+        
+    except Exception as e:
+        logger.error("Get thumbnail error: %s", e)
+        return jsonify({'error': 'Failed to create thumbnail'}), 500
 
-@app.route('/api/v1/images/<int:image_id>', methods=['DELETE'])
+@api.route('/api/v1/images/<int:image_id>', methods=['DELETE'])
 @require_api_key
 def delete_image(image_id):
     """Delete image by ID"""
@@ -735,81 +3999,437 @@ def delete_image(image_id):
         if not image:
             return jsonify({'error': 'Image not found'}), 404
         
+        content_hash = image.content_hash
+        blob_released = release_blob(content_hash) if content_hash else False
+        
         # Delete from database
         db.session.delete(image)
         db.session.commit()
+        response_cache.bump()
+        
+        # Drop the bytes and their thumbnails once no other row references them
+        if blob_released:
+            discard_blob(content_hash)
         
-        logger.info(f"Image deleted successfully: {image_id}")
+        logger.info("Image deleted successfully: %s", image_id)
         
         return jsonify({'message': 'Image deleted successfully'}), 200
         
     except SQLAlchemyError as e:
         db.session.rollback()
-        logger.error(f"Database error during deletion: {e}")
+        logger.error("Database error during deletion: %s", e)
         return jsonify({'error': 'Database error occurred'}), 500
     
     except Exception as e:
-        logger.error(f"Delete image error: {e}")
+        logger.error("Delete image error: %s", e)
         return jsonify({'error': 'Failed to delete image'}), 500
 
-@app.route('/api/v1/labels', methods=['GET'])
+@api.route('/api/v1/labels', methods=['GET'])
 @require_api_key
+@response_cache.cached
 def get_labels():
     """Get all unique labels with counts"""
     try:
         labels = db.session.query(
-            ImageData.label_name,
-            db.func.count(ImageData.id).label('count')
-        ).group_by(ImageData.label_name).all()
+            LabelDateStats.label_name,
+            db.func.sum(LabelDateStats.image_count).label('count')
+        ).group_by(LabelDateStats.label_name).all()
         
         return jsonify({
-            'data': [{'label_name': label[0], 'count': label[1]} for label in labels]
+            'data': [{'label_name': label[0], 'count': int(label[1])} for label in labels]
         }), 200
         
     except Exception as e:
-        logger.error(f"Get labels error: {e}")
+        logger.error("Get labels error: %s", e)
         return jsonify({'error': 'Failed to retrieve labels'}), 500
 
-@app.route('/api/v1/stats', methods=['GET'])
+@api.route('/api/v1/stats', methods=['GET'])
 @require_api_key
+@response_cache.cached
 def get_stats():
     """Get database statistics"""
     try:
-        total_images = ImageData.query.count()
-        total_labels = db.session.query(ImageData.label_name).distinct().count()
+        total_images = db.session.query(db.func.sum(LabelDateStats.image_count)).scalar() or 0
+        total_labels = db.session.query(LabelDateStats.label_name).distinct().count()
         
         # Get images by date
         images_by_date = db.session.query(
-            ImageData.date,
-            db.func.count(ImageData.id).label('count')
-        ).group_by(ImageData.date).order_by(ImageData.date.desc()).limit(30).all()
+            LabelDateStats.date,
+            db.func.sum(LabelDateStats.image_count).label('count')
+        ).group_by(LabelDateStats.date).order_by(LabelDateStats.date.desc()).limit(30).all()
         
         return jsonify({
-            'total_images': total_images,
+            'total_images': int(total_images),
             'total_labels': total_labels,
             'images_by_date': [
-                {'date': date.isoformat(), 'count': count} 
+                {'date': date.isoformat(), 'count': int(count)} 
                 for date, count in images_by_date
             ]
         }), 200
         
     except Exception as e:
-        logger.error(f"Get stats error: {e}")
+        logger.error("Get stats error: %s", e)
         return jsonify({'error': 'Failed to retrieve statistics'}), 500
 
+@api.route('/api/v1/jobs/stats', methods=['GET'])
+@require_api_key
+def get_job_stats():
+    """Get background job queue depth, latency and failures"""
+    try:
+        result = job_queue.stats()
+        
+        if current_app.config['JOB_QUEUE_PERSISTENT']:
+            result['by_status'] = dict(db.session.query(
+                BackgroundJob.status,
+                db.func.count(BackgroundJob.id)
+            ).group_by(BackgroundJob.status).all())
+        
+        return jsonify(result), 200
+        
+    except Exception as e:
+        logger.error("Get job stats error: %s", e)
+        return jsonify({'error': 'Failed to retrieve job statistics'}), 500
+
+def pool_stats(pool):
+    """Connection counts and checkout wait latency for one engine's pool"""
+    stats = {'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'in_use': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0)
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            'checkouts': pool.checkouts,
+            'timeouts': pool.timeouts,
+            'checkout_wait': latency_summary(pool.wait_times)
+        })
+    return stats
+
+@api.route('/api/v1/db/stats', methods=['GET'])
+@require_api_key
+def get_db_stats():
+    """Connection pool usage per database engine (primary and replica)"""
+    try:
+        return jsonify({
+            (bind_key or 'primary'): pool_stats(engine.pool)
+            for bind_key, engine in db.engines.items()
+        }), 200
+    except Exception as e:
+        logger.error("Get db stats error: %s", e)
+        return jsonify({'error': 'Failed to retrieve database stats'}), 500
+
+@metrics.collector
+def collect_pool_metrics():
+    for bind_key, engine in db.engines.items():
+        stats = pool_stats(engine.pool)
+        for state in ('in_use', 'idle', 'overflow'):
+            if state in stats:
+                db_pool_connections.set(stats[state], bind=bind_key or 'primary', state=state)
+
+@metrics.collector
+def collect_job_metrics():
+    stats = job_queue.stats()
+    job_queue_depth.set(stats['queue_depth'])
+    jobs_running.set(stats['running'])
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape endpoint; unauthenticated like /health, so keep it off public networks"""
+    if not current_app.config['METRICS_ENABLED']:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@api.route('/api/v1/exports', methods=['POST'])
+@require_api_key
+def create_export():
+    """Start a background archive export, or reuse one built from the same data"""
+    try:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return jsonify({'error': 'Expected a JSON body with a scope'}), 400
+        
+        try:
+            filters, compression = parse_export_request(body)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        signature = export_signature(filters, compression)
+        fingerprint = export_fingerprint(filters)
+        if fingerprint.startswith('0:'):
+            return jsonify({'error': 'No images found for these filters'}), 404
+        
+        export = find_reusable_export(signature, fingerprint)
+        reused = export is not None
+        if not reused:
+            active_key = export_active_key(signature, fingerprint)
+            export = ExportJob(
+                signature=signature,
+                filters=json.dumps(filters),
+                compression=compression,
+                fingerprint=fingerprint,
+                active_key=active_key,
+                heartbeat_at=datetime.utcnow()
+            )
+            try:
+                with db.session.begin_nested():
+                    db.session.add(export)
+                job_queue.enqueue('build_export', export_id=export.id)
+            except IntegrityError:
+                # A concurrent request created the same export first; a locking read sees its row
+                export = ExportJob.query.filter_by(active_key=active_key).with_for_update().one()
+                reused = True
+        db.session.commit()
+        
+        response = jsonify({**export.to_dict(), 'reused': reused, 'status_url': f'/api/v1/exports/{export.id}'})
+        response.status_code = 200 if export.status == 'done' else 202
+        response.headers['Location'] = f'/api/v1/exports/{export.id}'
+        return response
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Create export error: %s", e)
+        return jsonify({'error': 'Failed to create export'}), 500
+
+@api.route('/api/v1/exports/<int:export_id>', methods=['GET'])
+@require_api_key
+def get_export(export_id):
+    """Export status and progress"""
+    try:
+        export = db.session.get(ExportJob, export_id)
+        if not export:
+            return jsonify({'error': 'Export not found'}), 404
+        if export.is_stale():
+            # Its build died with a worker; pollers would otherwise wait forever
+            requeue_export(export)
+            db.session.commit()
+        return jsonify(export.to_dict()), 200
+    except Exception as e:
+        logger.error("Get export error: %s", e)
+        return jsonify({'error': 'Failed to retrieve export'}), 500
+
+@api.route('/api/v1/exports/<int:export_id>/download', methods=['GET'])
+@require_api_key
+def download_export(export_id):
+    """Download a finished export; supports Range requests for resuming"""
+    try:
+        export = db.session.get(ExportJob, export_id)
+        if not export:
+            return jsonify({'error': 'Export not found'}), 404
+        if export.status == 'expired' or (export.status == 'done' and not os.path.exists(export_path(export))):
+            return jsonify({'error': 'Export has expired, create it again'}), 410
+        if export.status != 'done':
+            return jsonify({'error': f'Export is not ready (status: {export.status})', **export.to_dict()}), 409
+        
+        return send_file(
+            os.path.abspath(export_path(export)),
+            mimetype='application/zstd' if export.compression == 'zstd' else 'application/zip',
+            as_attachment=True,
+            download_name=export.download_name,
+            conditional=True,
+            etag=f"export-{export.id}-{export.fingerprint}"
+        )
+    except Exception as e:
+        logger.error("Download export error: %s", e)
+        return jsonify({'error': 'Failed to download export'}), 500
+
 # Database initialization
-def create_tables():
+def create_tables(app):
     """Create database tables"""
     try:
         with app.app_context():
             db.create_all()
+            for name in (SYNC_SEQUENCE, ResponseCache.GENERATION_KEY):
+                if db.session.get(SyncSequence, name) is None:
+                    db.session.add(SyncSequence(name=name, value=0))
+            db.session.commit()
             logger.info("Database tables created successfully")
     except Exception as e:
-        logger.error(f"Failed to create database tables: {e}")
+        logger.error("Failed to create database tables: %s", e)
+
+@api.cli.command('migrate-blobs')
+@click.option('--batch-size', default=100, show_default=True, help='Rows moved per transaction')
+def migrate_blobs_command(batch_size):
+    """Move legacy image bytes out of MySQL into the blob store"""
+    moved = 0
+    last_id = 0
+    while True:
+        # Keyset on id, so each batch starts past the rows already moved instead of rescanning them
+        images = ImageData.query.options(undefer(ImageData.image)).filter(
+            ImageData.id > last_id, ImageData.image.isnot(None)
+        ).order_by(ImageData.id).limit(batch_size).all()
+        if not images:
+            break
+        last_id = images[-1].id
+        
+        for image in images:
+            content_hash = hashlib.sha256(image.image).hexdigest()
+            reference_blob(image.image, content_hash)
+            image.content_hash = content_hash
+            image.size = len(image.image)
+            image.image = None
+        
+        db.session.commit()
+        db.session.expunge_all()
+        moved += len(images)
+        logger.info("Moved %s image blobs to the blob store", moved)
+    
+    click.echo(f"Moved {moved} image blobs to the blob store")
+
+@api.cli.command('prune-exports')
+def prune_exports_command():
+    """Delete export artifacts past EXPORT_RETENTION or superseded by a newer build"""
+    click.echo(f"Expired {prune_exports()} exports")
+
+@api.cli.command('rebuild-stats')
+@click.option('--dry-run', is_flag=True, help='Only report how many rollup rows are out of date')
+def rebuild_stats_command(dry_run):
+    """Recount label_date_stats from singora_images"""
+    drift = rebuild_label_date_stats(dry_run)
+    if not dry_run:
+        response_cache.bump()
+    if dry_run:
+        click.echo(f"{drift} label/date rows out of date")
+    else:
+        click.echo(f"Rebuilt label_date_stats ({drift} rows corrected)")
+
+@api.cli.command('maintain-partitions')
+@click.option('--months-ahead', type=int, help='Months to pre-create past the current one [default: PARTITION_MONTHS_AHEAD]')
+@click.option('--dry-run', is_flag=True, help='Only list the partitions that would be added')
+def maintain_partitions_command(months_ahead, dry_run):
+    """Pre-create upcoming monthly partitions of singora_images (MySQL)"""
+    if db.engine.dialect.name != 'mysql':
+        click.echo("singora_images is only partitioned on MySQL; nothing to do")
+        return
+    if months_ahead is None:
+        months_ahead = current_app.config['PARTITION_MONTHS_AHEAD']
+    added = ensure_future_partitions(months_ahead, dry_run)
+    click.echo(f"{'Would add' if dry_run else 'Added'} {len(added)} partitions{': ' + ', '.join(added) if added else ''}")
+
+@api.cli.command('prune-images')
+@click.option('--months', type=int, help='Keep this many whole months besides the current one [default: RETENTION_MONTHS]')
+@click.option('--label', 'label_name', help='Prune only this label (with --days)')
+@click.option('--days', type=int, help='Delete images of --label older than this many days')
+@click.option('--dry-run', is_flag=True, help='Only report what would be deleted')
+def prune_images_command(months, label_name, days, dry_run):
+    """Delete images past their retention period"""
+    if (label_name is None) != (days is None):
+        raise click.UsageError('--label and --days go together')
+    if label_name is not None:
+        result = prune_images(months or 0, {label_name: days}, dry_run)
+    else:
+        result = prune_images(months, None, dry_run)
+    
+    if not result['rows']:
+        click.echo("No retention configured; set RETENTION_MONTHS or RETENTION_LABEL_DAYS")
+        return
+    
+    verb = 'Would delete' if dry_run else 'Deleted'
+    for name in result['partitions']:
+        click.echo(f"{verb} partition {name} (~{result['rows'][name]} rows)")
+    for scope, count in result['rows'].items():
+        if scope not in result['partitions']:
+            click.echo(f"{verb} {count} images ({scope})")
+
+def verify_image_record(image):
+    """Fully verify one image row, recording the result. Returns True if valid."""
+    try:
+        image_info = verify_image_data(image.get_image_bytes() or b'')
+    except Exception as e:
+        logger.warning("Could not read image %s for verification: %s", image.id, e)
+        image_info = None
+    
+    if image_info:
+        image.image_format, image.width, image.height = image_info
+        image.verification_status = 'verified'
+        return True
+    
+    image.verification_status = 'corrupt'
+    logger.warning("Image %s failed verification", image.id)
+    return False
+
+@job_queue.handler('verify_image')
+def verify_image_job(image_id):
+    image = db.session.get(ImageData, image_id)
+    if image and image.verification_status == 'pending':
+        verify_image_record(image)
+
+def verify_pending_images(batch_size=100, recheck=False):
+    """Run a full PIL verify over images that have only been header-checked.
+
+    Marks each row verified or corrupt (filling in format and dimensions for
+    legacy rows) and commits per batch. Returns (verified, corrupt) counts.
+    """
+    verified = corrupt = 0
+    last_id = 0
+    while True:
+        query = ImageData.query.filter(ImageData.id > last_id)
+        if not recheck:
+            query = query.filter(ImageData.verification_status == 'pending')
+        images = query.order_by(ImageData.id).limit(batch_size).all()
+        if not images:
+            break
+        
+        for image in images:
+            if verify_image_record(image):
+                verified += 1
+            else:
+                corrupt += 1
+        
+        last_id = images[-1].id
+        db.session.commit()
+        db.session.expunge_all()
+    
+    return verified, corrupt
+
+@api.cli.command('verify-images')
+@click.option('--batch-size', default=100, show_default=True, help='Rows checked per transaction')
+@click.option('--recheck', is_flag=True, help='Re-verify images already marked verified or corrupt')
+def verify_images_command(batch_size, recheck):
+    """Fully verify uploaded images and flag corrupt ones"""
+    verified, corrupt = verify_pending_images(batch_size, recheck)
+    click.echo(f"Verified {verified} images, flagged {corrupt} as corrupt")
+
+def create_app(config_object=Config):
+    """Application factory used by wsgi.py (gunicorn) and the flask CLI"""
+    app = Flask(__name__)
+    app.request_class = UploadLimitRequest
+    app.config.from_object(config_object)
+    configure_logging(app.config)
+    # Time pool checkouts for /api/v1/db/stats unless another pool class is configured
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'poolclass': TimedQueuePool, **app.config['SQLALCHEMY_ENGINE_OPTIONS']}
+    # URL-only binds don't inherit SQLALCHEMY_ENGINE_OPTIONS, so give the replica the same pool
+    app.config['SQLALCHEMY_BINDS'] = {
+        key: {**app.config['SQLALCHEMY_ENGINE_OPTIONS'], 'url': value} if isinstance(value, str) else value
+        for key, value in app.config['SQLALCHEMY_BINDS'].items()
+    }
+    
+    db.init_app(app)
+    migrate.init_app(app, db)
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            engine.pool.bind_key = bind_key or 'primary'
+    CORS(app)
+    app.register_blueprint(api)
+    
+    # Per-app state, looked up through current_app so several apps in one process stay apart
+    app.extensions['singora_blob_store'] = create_blob_store(app.config)
+    app.extensions['singora_thumbnail_cache'] = ThumbnailCache()
+    app.extensions['singora_response_cache'] = ResponseCache.create_backend(app.config)
+    app.extensions['singora_validation_pool'] = create_validation_pool(app.config)
+    app.extensions['singora_job_queue'] = JobQueueState(app)
+    app.extensions['singora_metrics'] = {'flushing': False}
+    
+    return app
 
 if __name__ == '__main__':
+    # Development server only; production runs gunicorn against wsgi:app
+    app = create_app()
+    
     # Create tables if they don't exist
-    create_tables()
+    create_tables(app)
     
     # Run the application
     app.run(
@@ -0,0 +1,77 @@
+"""Compare archive throughput and size for each download compression mode.
+
+Builds archives from synthetic JPEG and PNG images (random noise plus
+gradients, so the encoders cannot shrink them to nothing) through the same
+stream_zip / stream_tar_zstd generators the download routes use. No database
+is needed.
+
+Run from the repository root:
+
+    python -m benchmarks.archive_compression --images 200 --size 640 --runs 3
+"""
+import argparse
+import io
+import os
+import statistics
+import time
+
+from PIL import Image
+
+from app import ARCHIVE_COMPRESSIONS, stream_tar_zstd, stream_zip, zstandard
+
+
+def synthetic_images(count, size, image_format):
+    """Return (filename, bytes) entries for count noisy size x size images"""
+    entries = []
+    for i in range(count):
+        noise = Image.frombytes('L', (size, size), os.urandom(size * size)).convert('RGB')
+        gradient = Image.linear_gradient('L').resize((size, size)).convert('RGB')
+        image = Image.blend(noise, gradient, 0.6)
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format)
+        entries.append((f"{i}.{image_format.lower()}", buffer.getvalue()))
+    return entries
+
+
+def build_archive(entries, compression, zstd_level):
+    if compression == 'zstd':
+        chunks = stream_tar_zstd(iter(entries), zstd_level)
+    else:
+        chunks = stream_zip(iter(entries), ARCHIVE_COMPRESSIONS[compression])
+    return sum(len(chunk) for chunk in chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--size', type=int, default=640, help='image width/height in pixels')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--zstd-level', type=int, default=3)
+    args = parser.parse_args()
+
+    modes = [mode for mode in ARCHIVE_COMPRESSIONS if mode != 'zstd' or zstandard is not None]
+
+    for image_format in ('JPEG', 'PNG'):
+        entries = synthetic_images(args.images, args.size, image_format)
+        payload = sum(len(data) for _, data in entries)
+        print(f"== {image_format}: {len(entries)} images, {payload / 1024 / 1024:.1f} MiB payload")
+
+        for mode in modes:
+            durations = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                archive_size = build_archive(entries, mode, args.zstd_level)
+                durations.append(time.perf_counter() - started)
+            seconds = statistics.median(durations)
+            print(
+                f"  {mode:8} {payload / 1024 / 1024 / seconds:8.1f} MiB/s  "
+                f"{archive_size / payload * 100:6.2f}% of payload  "
+                f"({seconds * 1000:.1f} ms median of {args.runs})"
+            )
+
+    if 'zstd' not in modes:
+        print("zstandard is not installed; zstd mode skipped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Load-test uploads and downloads under each gunicorn worker model.
+
+For every mode in --modes this starts `gunicorn -c gunicorn.conf.py wsgi:app`
+with GUNICORN_WORKER_CLASS set, waits for /health, then drives it with
+--concurrency client threads: first raw uploads (POST /api/v1/images/ingest),
+then ZIP downloads of a label seeded with --download-images images. It
+prints requests/sec and p50/p99 latency per mode. The server uses the
+database and blob storage from the environment, so point it at a scratch
+database.
+
+Run from the repository root:
+
+    python -m benchmarks.load_test --modes sync,gthread,gevent --concurrency 16 --duration 20
+
+Pass --url to measure an already running server instead (one "external" mode).
+"""
+import argparse
+import io
+import itertools
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from PIL import Image
+
+
+def make_image(size=256):
+    image = Image.frombytes('RGB', (size, size), os.urandom(size * size * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def with_comment(jpeg, comment):
+    """jpeg with a comment segment after SOI: the same picture, but a different payload hash"""
+    comment = comment.encode('ascii')
+    return jpeg[:2] + b'\xff\xfe' + (len(comment) + 2).to_bytes(2, 'big') + comment + jpeg[2:]
+
+
+def request(url, api_key, data=None, headers=None):
+    req = urllib.request.Request(url, data=data, headers={'singora-API-Key': api_key, **(headers or {})})
+    with urllib.request.urlopen(req, timeout=300) as response:
+        while response.read(1024 * 1024):
+            pass
+        return response.status
+
+
+def run_phase(name, concurrency, duration, call):
+    """Call call() from concurrency threads for duration seconds; print throughput and latency"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                call()
+            except (urllib.error.URLError, OSError):
+                with lock:
+                    errors += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    if latencies:
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(
+            f"  {name:9} {len(latencies) / elapsed:8.1f} req/s  "
+            f"p50 {statistics.median(latencies) * 1000:7.1f} ms  p99 {p99 * 1000:7.1f} ms  "
+            f"({len(latencies)} ok, {errors} errors)"
+        )
+    else:
+        print(f"  {name:9} no successful requests ({errors} errors)")
+
+
+def wait_for_health(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/health", timeout=2):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    raise RuntimeError(f"Server at {url} did not become healthy")
+
+
+def benchmark(url, args, label):
+    image = make_image(args.image_size)
+    numbers = itertools.count()
+    run_token = uuid.uuid4().hex
+
+    def upload(label_name):
+        # A distinct payload per request, so uploads are stored rather than deduplicated
+        data = with_comment(image, f"load {run_token} {next(numbers)}")
+        return request(
+            f"{url}/api/v1/images/ingest", args.api_key, data=data,
+            headers={'Content-Type': 'image/jpeg', 'X-Label-Name': label_name}
+        )
+
+    # Downloads fetch a label of fixed size, so modes are compared on equal archives
+    for _ in range(args.download_images):
+        upload(f"{label}_download")
+
+    run_phase('upload', args.concurrency, args.duration, lambda: upload(f"{label}_upload"))
+    run_phase(
+        'download', args.concurrency, args.duration,
+        lambda: request(f"{url}/api/v1/images/download/label/{label}_download", args.api_key)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--modes', default='sync,gthread,gevent', help='comma separated worker classes')
+    parser.add_argument('--url', help='benchmark a running server instead of starting gunicorn')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20, help='seconds per phase')
+    parser.add_argument('--image-size', type=int, default=256, help='uploaded JPEG width/height')
+    parser.add_argument('--download-images', type=int, default=50, help='images in the downloaded label')
+    parser.add_argument('--api-key', default=os.getenv('API_KEY', '12345'))
+    args = parser.parse_args()
+
+    if args.url:
+        print(f"== external ({args.url})")
+        benchmark(args.url.rstrip('/'), args, f"loadtest_{int(time.time())}")
+        return
+
+    url = f"http://127.0.0.1:{args.port}"
+    for mode in args.modes.split(','):
+        env = dict(os.environ, GUNICORN_WORKER_CLASS=mode, GUNICORN_BIND=f"127.0.0.1:{args.port}", GUNICORN_ACCESS_LOG='')
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_for_health(url)
+            print(f"== {mode}")
+            benchmark(url, args, f"loadtest_{mode}_{int(time.time())}")
+        except RuntimeError as e:
+            print(f"== {mode}: {e}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
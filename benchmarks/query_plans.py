@@ -0,0 +1,126 @@
+"""Compare query plans and timings for the hot singora_images queries.
+
+"Before" reproduces the old access path: every column selected (the ORM
+loaded the MEDIUMBLOB with each row), the composite indexes ignored, and the
+old single-column ix_singora_images_label_name index available. That index
+was dropped by migration 13913723f186, so it is recreated for the run and
+dropped again afterwards. "After" selects metadata columns only, as the
+deferred `image` column does, and lets MySQL use the composite indexes.
+
+Building the index locks and scans the table, so run it from the repository
+root against a scratch copy of the MySQL database:
+
+    python -m benchmarks.query_plans --label cat --date 2025-06-24 \
+        --date-from 2025-06-01 --date-to 2025-06-30 --runs 5
+"""
+import argparse
+import statistics
+import time
+
+from app import create_app, db, ImageData
+
+COMPOSITE_INDEXES = 'ix_singora_images_label_date_ts, ix_singora_images_date_label'
+LEGACY_INDEX = 'ix_singora_images_label_name'
+METADATA_COLUMNS = 'id, label_name, date, timestamp, content_hash, size'
+
+QUERIES = {
+    'label_and_date': (
+        "WHERE label_name = :label AND date = :date ORDER BY timestamp DESC LIMIT 100"
+    ),
+    'date_only': (
+        "WHERE date = :date ORDER BY label_name, timestamp"
+    ),
+    'label_and_date_range': (
+        "WHERE label_name = :label AND date BETWEEN :date_from AND :date_to ORDER BY date, timestamp"
+    ),
+}
+
+# get_download_info aggregates without reading rows, so only the index choice differs
+AGGREGATE = (
+    "SELECT label_name, COUNT(id), MIN(date), MAX(date) FROM singora_images {hint} GROUP BY label_name"
+)
+
+
+def explain(sql, params):
+    rows = db.session.execute(db.text(f"EXPLAIN {sql}"), params).mappings().all()
+    return [
+        f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']} extra={row['Extra']}"
+        for row in rows
+    ]
+
+
+def index_exists(name):
+    return db.session.execute(
+        db.text("SHOW INDEX FROM singora_images WHERE Key_name = :name"), {'name': name}
+    ).first() is not None
+
+
+def time_query(sql, params, runs):
+    durations = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        db.session.execute(db.text(sql), params).fetchall()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--label', required=True)
+    parser.add_argument('--date', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--date-from', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--date-to', required=True, help='YYYY-MM-DD')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument(
+        '--no-legacy-index', action='store_true',
+        help=f"don't recreate {LEGACY_INDEX}; the before plans then only approximate the old schema"
+    )
+    args = parser.parse_args()
+
+    params = {'label': args.label, 'date': args.date, 'date_from': args.date_from, 'date_to': args.date_to}
+
+    with create_app().app_context():
+        created_legacy_index = False
+        if not args.no_legacy_index and not index_exists(LEGACY_INDEX):
+            print(f"Recreating {LEGACY_INDEX} for the before plans")
+            db.session.execute(db.text(f"CREATE INDEX {LEGACY_INDEX} ON singora_images (label_name)"))
+            created_legacy_index = True
+        if not index_exists(LEGACY_INDEX):
+            print(
+                f"Note: {LEGACY_INDEX} does not exist, so the before plans cannot use it and "
+                "overstate the improvement"
+            )
+
+        # The after plans must not pick up an index the current schema doesn't have
+        after_hint = f"IGNORE INDEX ({LEGACY_INDEX})" if created_legacy_index else ''
+        cases = {
+            name: (
+                f"SELECT * FROM singora_images IGNORE INDEX ({COMPOSITE_INDEXES}) {where}",
+                f"SELECT {METADATA_COLUMNS} FROM singora_images {after_hint} {where}",
+            )
+            for name, where in QUERIES.items()
+        }
+        cases['download_info'] = (
+            AGGREGATE.format(hint=f"IGNORE INDEX ({COMPOSITE_INDEXES})"),
+            AGGREGATE.format(hint=after_hint),
+        )
+
+        try:
+            for name, (before_sql, after_sql) in cases.items():
+                print(f"== {name}")
+                for label, sql in (('before', before_sql), ('after', after_sql)):
+                    print(f"  {label}: {time_query(sql, params, args.runs):.2f} ms (median of {args.runs})")
+                    for line in explain(sql, params):
+                        print(f"    {line}")
+        finally:
+            if created_legacy_index:
+                db.session.execute(db.text(f"DROP INDEX {LEGACY_INDEX} ON singora_images"))
+
+        # The ORM side of the change: metadata queries no longer select the blob column
+        statement = ImageData.query.filter(ImageData.label_name == args.label).statement
+        print("== ORM metadata query")
+        print(f"  {statement.compile(db.engine)}")
+
+
+if __name__ == '__main__':
+    main()
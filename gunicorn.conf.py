@@ -0,0 +1,75 @@
+"""Gunicorn settings for the image API.
+
+Pick a worker model with GUNICORN_WORKER_CLASS (default gthread):
+
+- sync:    one request per process. Simple, but a ZIP download holds its
+           worker for the whole transfer, and the arbiter kills any worker
+           silent for `timeout` seconds, so the timeout has to cover the
+           slowest download (GUNICORN_TIMEOUT, default 900s here).
+- gthread: GUNICORN_THREADS requests per process. The worker heartbeats from
+           its main thread while request threads stream archives, so the
+           timeout only guards against hung processes (default 60s).
+- gevent:  cooperative greenlets (pip install gevent). Good for many slow
+           clients; CPU-bound work (validation, thumbnails, deflate) blocks
+           the whole process while it runs (default timeout 60s).
+
+Any preset value can be overridden with the matching GUNICORN_* variable.
+"""
+import multiprocessing
+import os
+
+cores = multiprocessing.cpu_count()
+worker_model = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+
+PRESETS = {
+    'sync': {
+        'workers': cores * 2 + 1,
+        'threads': 1,
+        'timeout': 900,
+    },
+    'gthread': {
+        'workers': cores + 1,
+        'threads': 8,
+        'timeout': 60,
+    },
+    'gevent': {
+        'workers': cores,
+        'threads': 1,
+        'timeout': 60,
+        'worker_connections': 1000,
+    },
+}
+
+if worker_model not in PRESETS:
+    raise RuntimeError(f"GUNICORN_WORKER_CLASS must be one of: {', '.join(PRESETS)}")
+preset = PRESETS[worker_model]
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', 5000)}")
+worker_class = worker_model
+workers = int(os.getenv('GUNICORN_WORKERS', preset['workers']))
+threads = int(os.getenv('GUNICORN_THREADS', preset['threads']))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', preset['timeout']))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', preset.get('worker_connections', 1000)))
+
+# Finish in-flight downloads on reload/shutdown before killing the worker
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 120))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then to cap slow memory growth (PIL, spooled archives)
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+# Each worker starts its own job queue threads lazily, so the app is not preloaded
+preload_app = False
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+
+
+def on_starting(server):
+    """Start each server run with fresh metric snapshots (see METRICS_DIR)"""
+    metrics_dir = os.getenv('METRICS_DIR')
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for file_name in os.listdir(metrics_dir):
+            if file_name.endswith('.json'):
+                os.remove(os.path.join(metrics_dir, file_name))
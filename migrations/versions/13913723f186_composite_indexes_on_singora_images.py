@@ -0,0 +1,31 @@
+"""composite indexes on singora_images
+
+Revision ID: 13913723f186
+Revises: 7a9110c41e13
+Create Date: 2026-10-16 22:32:02.582821
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '13913723f186'
+down_revision = '7a9110c41e13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('singora_images') as batch_op:
+        batch_op.create_index('ix_singora_images_label_date_ts', ['label_name', 'date', 'timestamp'], unique=False)
+        batch_op.create_index('ix_singora_images_date_label', ['date', 'label_name'], unique=False)
+        # Covered by the leftmost prefix of ix_singora_images_label_date_ts
+        batch_op.drop_index('ix_singora_images_label_name')
+
+
+def downgrade():
+    with op.batch_alter_table('singora_images') as batch_op:
+        batch_op.create_index('ix_singora_images_label_name', ['label_name'], unique=False)
+        batch_op.drop_index('ix_singora_images_date_label')
+        batch_op.drop_index('ix_singora_images_label_date_ts')
@@ -0,0 +1,46 @@
+"""add background export table
+
+Revision ID: 190d97e34eeb
+Revises: 2e5502855d9f
+Create Date: 2026-10-16 22:39:33.644847
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '190d97e34eeb'
+down_revision = '2e5502855d9f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'singora_exports',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('signature', sa.String(length=64), nullable=False),
+        sa.Column('filters', sa.Text(), nullable=False),
+        sa.Column('compression', sa.String(length=16), nullable=False),
+        sa.Column('fingerprint', sa.String(length=64), nullable=True),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('total_entries', sa.Integer(), nullable=True),
+        sa.Column('processed_entries', sa.Integer(), nullable=False),
+        sa.Column('file_name', sa.String(length=255), nullable=True),
+        sa.Column('download_name', sa.String(length=255), nullable=True),
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_singora_exports_signature'), 'singora_exports', ['signature'], unique=False)
+    op.create_index(op.f('ix_singora_exports_status'), 'singora_exports', ['status'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_singora_exports_status'), table_name='singora_exports')
+    op.drop_index(op.f('ix_singora_exports_signature'), table_name='singora_exports')
+    op.drop_table('singora_exports')
@@ -0,0 +1,34 @@
+"""label date stats rollup
+
+Revision ID: 2e5502855d9f
+Revises: 13913723f186
+Create Date: 2026-10-16 22:33:07.775544
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2e5502855d9f'
+down_revision = '13913723f186'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'label_date_stats',
+        sa.Column('label_name', sa.String(length=255), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('image_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('label_name', 'date')
+    )
+    op.execute(
+        "INSERT INTO label_date_stats (label_name, date, image_count) "
+        "SELECT label_name, date, COUNT(*) FROM singora_images GROUP BY label_name, date"
+    )
+
+
+def downgrade():
+    op.drop_table('label_date_stats')
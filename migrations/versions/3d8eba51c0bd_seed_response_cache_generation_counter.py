@@ -0,0 +1,26 @@
+"""seed response cache generation counter
+
+Revision ID: 3d8eba51c0bd
+Revises: bad7080eacb5
+Create Date: 2026-10-16 23:26:53.807236
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3d8eba51c0bd'
+down_revision = 'bad7080eacb5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The memory response cache keeps its generation here so every worker sees bumps
+    sequences = sa.table('singora_sync_sequences', sa.column('name', sa.String), sa.column('value', sa.BigInteger))
+    op.bulk_insert(sequences, [{'name': 'response_cache', 'value': 0}])
+
+
+def downgrade():
+    op.execute("DELETE FROM singora_sync_sequences WHERE name = 'response_cache'")
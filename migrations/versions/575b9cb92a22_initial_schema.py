@@ -0,0 +1,34 @@
+"""initial schema
+
+Revision ID: 575b9cb92a22
+Revises: 
+Create Date: 2026-10-16 22:24:45.187801
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '575b9cb92a22'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'singora_images',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('image', sa.LargeBinary(length=16777215), nullable=False),
+        sa.Column('label_name', sa.String(length=255), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_singora_images_label_name'), 'singora_images', ['label_name'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_singora_images_label_name'), table_name='singora_images')
+    op.drop_table('singora_images')
@@ -0,0 +1,41 @@
+"""deduplicate blobs by content hash
+
+Revision ID: 66f092ad7eb2
+Revises: dc3188167c64
+Create Date: 2026-10-16 22:25:42.331139
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '66f092ad7eb2'
+down_revision = 'dc3188167c64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'singora_blobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_singora_blobs_content_hash'), 'singora_blobs', ['content_hash'], unique=True)
+
+    # Register blobs already referenced by images
+    op.execute(
+        "INSERT INTO singora_blobs (content_hash, size, ref_count, created_at) "
+        "SELECT content_hash, MAX(size), COUNT(*), MIN(timestamp) FROM singora_images "
+        "WHERE content_hash IS NOT NULL GROUP BY content_hash"
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_singora_blobs_content_hash'), table_name='singora_blobs')
+    op.drop_table('singora_blobs')
@@ -0,0 +1,38 @@
+"""add background job queue table
+
+Revision ID: 7a9110c41e13
+Revises: 973779ba5087
+Create Date: 2026-10-16 22:29:09.016230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a9110c41e13'
+down_revision = '973779ba5087'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'singora_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_type', sa.String(length=64), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_singora_jobs_status'), 'singora_jobs', ['status'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_singora_jobs_status'), table_name='singora_jobs')
+    op.drop_table('singora_jobs')
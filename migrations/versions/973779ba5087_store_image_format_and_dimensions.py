@@ -0,0 +1,35 @@
+"""store image format and dimensions
+
+Revision ID: 973779ba5087
+Revises: 66f092ad7eb2
+Create Date: 2026-10-16 22:27:59.384411
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '973779ba5087'
+down_revision = '66f092ad7eb2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('singora_images') as batch_op:
+        batch_op.add_column(sa.Column('image_format', sa.String(length=16), nullable=True))
+        batch_op.add_column(sa.Column('width', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('height', sa.Integer(), nullable=True))
+        # Existing rows start pending; `flask verify-images` fills in format and size
+        batch_op.add_column(sa.Column('verification_status', sa.String(length=16), nullable=False, server_default='pending'))
+        batch_op.create_index(batch_op.f('ix_singora_images_verification_status'), ['verification_status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('singora_images') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_singora_images_verification_status'))
+        batch_op.drop_column('verification_status')
+        batch_op.drop_column('height')
+        batch_op.drop_column('width')
+        batch_op.drop_column('image_format')
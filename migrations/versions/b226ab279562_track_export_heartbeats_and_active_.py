@@ -0,0 +1,30 @@
+"""track export heartbeats and active builds
+
+Revision ID: b226ab279562
+Revises: e3cbb196edc1
+Create Date: 2026-10-16 23:12:03.682165
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b226ab279562'
+down_revision = 'e3cbb196edc1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('singora_exports') as batch_op:
+        batch_op.add_column(sa.Column('active_key', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_singora_exports_active_key'), ['active_key'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('singora_exports') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_singora_exports_active_key'))
+        batch_op.drop_column('heartbeat_at')
+        batch_op.drop_column('active_key')
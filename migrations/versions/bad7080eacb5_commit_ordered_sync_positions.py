@@ -0,0 +1,39 @@
+"""commit ordered sync positions
+
+Revision ID: bad7080eacb5
+Revises: b226ab279562
+Create Date: 2026-10-16 23:14:39.467244
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bad7080eacb5'
+down_revision = 'b226ab279562'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    sequences = op.create_table(
+        'singora_sync_sequences',
+        sa.Column('name', sa.String(length=32), nullable=False),
+        sa.Column('value', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(sequences, [{'name': 'changes', 'value': 0}])
+    # Existing rows keep position 0 and stay ordered by id within it, so old cursors still work
+    for table in ('singora_images', 'singora_tombstones'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('sync_seq', sa.BigInteger(), server_default='0', nullable=False))
+            batch_op.create_index(f'ix_{table}_sync_seq', ['sync_seq', 'id'], unique=False)
+
+
+def downgrade():
+    for table in ('singora_tombstones', 'singora_images'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_index(f'ix_{table}_sync_seq')
+            batch_op.drop_column('sync_seq')
+    op.drop_table('singora_sync_sequences')
@@ -0,0 +1,34 @@
+"""move image blobs to blob store
+
+Revision ID: dc3188167c64
+Revises: 575b9cb92a22
+Create Date: 2026-10-16 22:24:46.014857
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'dc3188167c64'
+down_revision = '575b9cb92a22'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('singora_images') as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('size', sa.Integer(), nullable=True))
+        # Legacy rows keep their bytes here until `flask migrate-blobs` moves them out
+        batch_op.alter_column('image', existing_type=sa.LargeBinary(length=16777215), nullable=True)
+        batch_op.create_index(batch_op.f('ix_singora_images_content_hash'), ['content_hash'], unique=False)
+
+
+def downgrade():
+    # Rows already moved to the blob store have no bytes left in the table
+    with op.batch_alter_table('singora_images') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_singora_images_content_hash'))
+        batch_op.alter_column('image', existing_type=sa.LargeBinary(length=16777215), nullable=False)
+        batch_op.drop_column('size')
+        batch_op.drop_column('content_hash')
@@ -0,0 +1,54 @@
+"""partition singora_images by month
+
+Revision ID: e3cbb196edc1
+Revises: ed426e50b8c2
+Create Date: 2026-10-16 22:58:48.930011
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3cbb196edc1'
+down_revision = 'ed426e50b8c2'
+branch_labels = None
+depends_on = None
+
+# Months pre-created past the current one; `flask maintain-partitions` keeps extending
+MONTHS_AHEAD = 3
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return day.replace(year=day.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'mysql':
+        # Partitioning is MySQL-only; other databases keep the plain table
+        return
+
+    this_month = datetime.utcnow().date().replace(day=1)
+    oldest = bind.execute(sa.text('SELECT MIN(date) FROM singora_images')).scalar()
+    month = oldest.replace(day=1) if oldest else this_month
+    partitions = []
+    while month <= add_months(this_month, MONTHS_AHEAD):
+        upper = add_months(month, 1)
+        partitions.append(f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{upper.isoformat()}')")
+        month = upper
+    partitions.append('PARTITION pfuture VALUES LESS THAN (MAXVALUE)')
+
+    # Every unique key of a partitioned table must contain the partitioning column
+    op.execute('ALTER TABLE singora_images DROP PRIMARY KEY, ADD PRIMARY KEY (id, date)')
+    op.execute(f"ALTER TABLE singora_images PARTITION BY RANGE COLUMNS(date) ({', '.join(partitions)})")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'mysql':
+        return
+    op.execute('ALTER TABLE singora_images REMOVE PARTITIONING')
+    op.execute('ALTER TABLE singora_images DROP PRIMARY KEY, ADD PRIMARY KEY (id)')
@@ -0,0 +1,36 @@
+"""record image tombstones for sync
+
+Revision ID: ed426e50b8c2
+Revises: 190d97e34eeb
+Create Date: 2026-10-16 22:41:21.695545
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ed426e50b8c2'
+down_revision = '190d97e34eeb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'singora_tombstones',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('image_id', sa.Integer(), nullable=False),
+        sa.Column('label_name', sa.String(length=255), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('content_hash', sa.String(length=64), nullable=True),
+        sa.Column('size', sa.Integer(), nullable=True),
+        sa.Column('deleted_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_singora_tombstones_label_name'), 'singora_tombstones', ['label_name'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_singora_tombstones_label_name'), table_name='singora_tombstones')
+    op.drop_table('singora_tombstones')